@@ -4,13 +4,15 @@ import threading
 
 from robothead  import RobotHead
 from robotbody  import RobotBody
+from robotscheduler import RobotScheduler
+from robotbackend  import create_backend
 
 class Robot:
     """
     This class implements the robot methods.
     """
 
-    def __init__ (self, name):
+    def __init__ (self, name, rate=100.0, backend="pca9685", clock=None, address=0x40):
         """
         Create the robot.
 
@@ -18,15 +20,25 @@ class Robot:
         ----------
         name : string
             The robot nickname.
+        rate : float, optional
+            The motion scheduler tick rate in Hz (default is 100.0).
+        backend : string, optional
+            The servo board backend, one of robotbackend.BACKENDS (default is "pca9685").
+        clock : RobotClock, optional
+            The clock driving the motion scheduler, None (default) for the wall clock.
+        address : int, optional
+            The I2C address of the servo board (default is 0x40).
         """
         self._initialized = False
         self._name        = name
         self._globalLock  = threading.Lock()
+        self._board       = create_backend(backend, self._globalLock, address, clock)
+        self._scheduler   = RobotScheduler(rate, clock)
 
         # Create the head and the body.
         #
-        self._head = RobotHead(self._globalLock)
-        self._body = RobotBody(self._globalLock)
+        self._head = RobotHead(self._board, self._scheduler)
+        self._body = RobotBody(self._board, self._scheduler)
 
         return
 
@@ -62,6 +74,28 @@ class Robot:
         """
         return self._head
     
+    def scheduler(self):
+        """
+        Get the robot motion scheduler.
+
+        Returns
+        -------
+        object
+            The motion scheduler.
+        """
+        return self._scheduler
+
+    def board(self):
+        """
+        Get the robot servo board.
+
+        Returns
+        -------
+        object
+            The servo board.
+        """
+        return self._board
+
     def body(self):
         """
         Get the robot body.
@@ -73,6 +107,67 @@ class Robot:
         """
         return self._body
     
+    def joints(self):
+        """
+        Get all the robot servos by joint name, the head joints are named "head/<joint>" and
+        the body joints "body/<joint>".
+
+        Returns
+        -------
+        dict
+            The servo of each joint.
+        """
+        joints = {}
+        for name, servo in self._head.servos().items():
+            joints["head/" + name] = servo
+        for name, servo in self._body.servos().items():
+            joints["body/" + name] = servo
+        return joints
+
+    def snapshot(self):
+        """
+        Get the state of all the joints.
+
+        Returns
+        -------
+        dict
+            The (position, target, moving) snapshot of each joint, by joint name.
+        """
+        return {joint : servo.snapshot() for joint, servo in self.joints().items()}
+
+    def pose(self, targets, on_write=None):
+        """
+        Move several joints within the same scheduler tick. The moves retarget any movement in
+        progress instead of waiting for it.
+
+        Parameters
+        ----------
+        targets : dict
+            The (position, speed, steps) of each joint to move, by joint name. A speed 0.0
+            indicates a direct move.
+        on_write : callable, optional
+            A callback called once the first angle of each joint movement is handed over to
+            the board (see RobotServo.move).
+        """
+        joints = self.joints()
+        with self._scheduler.batch():
+            for joint, (position, speed, steps) in targets.items():
+                joints[joint].move(position, speed, steps, retarget=True, on_write=on_write)
+        return
+
+    def set_retarget(self, enabled):
+        """
+        Set the "latest target wins" mode of all the servos.
+
+        Parameters
+        ----------
+        enabled : bool
+            True to retarget the current movements instead of waiting for them.
+        """
+        for servo in self.joints().values():
+            servo.set_retarget(enabled)
+        return
+
     def shutdown(self):
         """
         Shutdown the robot.
@@ -80,6 +175,7 @@ class Robot:
         if self._initialized:
             self._body.shutdown()
             self._head.shutdown()
+            self._scheduler.shutdown()
             self._initialized = False
         return
 
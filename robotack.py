@@ -0,0 +1,132 @@
+import json
+import time
+import logging
+import threading
+
+# The acknowledgement topic of a single robot, the robots of a fleet publish theirs on
+# "robot/<name>/ack".
+#
+ACK_TOPIC = "robot/ack"
+
+# The correlation keys of the JSON commands.
+#
+ACK_KEYS = ("id", "ts")
+
+def correlation(payload):
+    """
+    Get the correlation id and client timestamp of a JSON command. The text payloads are only
+    parsed when they look like a JSON object with an id, so the plain commands cost nothing.
+
+    Parameters
+    ----------
+    payload : bytes or string
+        The command payload.
+
+    Returns
+    -------
+    tuple
+        The correlation id and client timestamp (None if missing), (None, None) if the
+        command does not request an acknowledgement.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    if (not payload.startswith(b"{")) or (b'"id"' not in payload):
+        return None, None
+    try:
+        command = json.loads(payload)
+    except ValueError:
+        return None, None
+    if not isinstance(command, dict):
+        return None, None
+    return command.get("id"), command.get("ts")
+
+
+class RobotAck:
+    """
+    This class implements the acknowledgement of a command: it collects the timestamps of the
+    command (received, dispatched, first servo write and move completed) and publishes them
+    once all the servos it moves have completed. The timestamps are wall clock seconds so
+    they can be compared with the client timestamp.
+    """
+
+    def __init__ (self, client, msg, cid, ts=None, topic=ACK_TOPIC):
+        """
+        Start the acknowledgement of a command being dispatched.
+
+        Parameters
+        ----------
+        client : mqtt.Client
+            The MQTT client publishing the acknowledgement.
+        msg : mqtt.MQTTMessage
+            The command message.
+        cid : object
+            The correlation id.
+        ts : float, optional
+            The client timestamp, None (default) if unknown.
+        topic : string, optional
+            The acknowledgement topic (default is ACK_TOPIC).
+        """
+        now = time.time()
+        self._client     = client
+        self._topic      = topic
+        self._lock       = threading.Lock()
+        self._pending    = 0
+        self._published  = False
+        self._ack        = {
+            "id"          : cid,
+            "topic"       : msg.topic,
+            "client_ts"   : ts,
+            "received"    : now - (time.monotonic() - msg.timestamp),
+            "dispatched"  : now,
+            "first_write" : None,
+            "completed"   : None,
+        }
+        return
+
+    def watch(self, servos):
+        """
+        Watch the completion of the servo movements, called once they have been started. The
+        acknowledgement is published when all of them are completed.
+
+        Parameters
+        ----------
+        servos : list
+            The servos moved by the command.
+        """
+        self._lock.acquire()
+        self._pending = len(servos)
+        self._lock.release()
+        if not servos:
+            self._on_done()
+        for servo in servos:
+            servo.add_done_callback(self._on_done)
+        return
+
+    def on_write(self):
+        """
+        Record the first servo write, passed as the on_write callback of the moves.
+        """
+        self._lock.acquire()
+        if (self._ack["first_write"] is None) and not self._published:
+            self._ack["first_write"] = time.time()
+        self._lock.release()
+        return
+
+    def _on_done(self):
+        """
+        Count a completed movement, publishing the acknowledgement after the last one.
+        """
+        self._lock.acquire()
+        self._pending = self._pending - 1
+        publish = (self._pending <= 0) and not self._published
+        if publish:
+            self._published = True
+            self._ack["completed"] = time.time()
+            payload = json.dumps(self._ack, separators=(",", ":"))
+        self._lock.release()
+        if publish:
+            try:
+                self._client.publish(self._topic, payload)
+            except Exception:
+                logging.exception("ack: publish failed.")
+        return
@@ -0,0 +1,511 @@
+import os
+import asyncio
+import logging
+import argparse
+import paho.mqtt.client as mqtt
+
+from robot import Robot
+from robotmqtt import RobotMQTT, on_message
+from robotexecutor import RobotExecutor
+from robotchoreography import RobotChoreographyCache, RobotChoreographyLibrary
+from robottelemetry import RobotTelemetry
+from robotlog import setup_logging
+
+def _resolve(future):
+    """
+    Complete a movement future, unless its waiter has given up.
+
+    Parameters
+    ----------
+    future : asyncio.Future
+        The future to complete.
+    """
+    if not future.done():
+        future.set_result(None)
+    return
+
+class RobotAsyncServo:
+    """
+    This class implements the asyncio facade of a servo. The movements are still performed by
+    the motion scheduler thread, the waits are futures completed by the servo done callbacks
+    so they cost no thread.
+    """
+
+    def __init__ (self, servo, loop):
+        """
+        Initialize the facade.
+
+        Parameters
+        ----------
+        servo : RobotServo
+            The servo to operate.
+        loop : asyncio.AbstractEventLoop
+            The event loop of the waiters.
+        """
+        self._servo = servo
+        self._loop  = loop
+        return
+
+    def servo(self):
+        """
+        Get the servo.
+
+        Returns
+        -------
+        RobotServo
+            The servo operated by the facade.
+        """
+        return self._servo
+
+    def position(self):
+        """
+        Get the current position.
+
+        Returns
+        -------
+        float
+            The current position.
+        """
+        return self._servo.position()
+
+    async def move(self, position, speed=0.0, steps=10, profile=None):
+        """
+        Move the servo to a given position and wait until the movement is completed. The move
+        retargets any movement in progress, the latest target wins.
+
+        Parameters
+        ----------
+        position : float
+            The final servo position.
+        speed : float, optional
+            The movement speed in units per second, 0.0 (default) for a direct move.
+        steps : int, optional
+            The number of steps to perform (default is 10).
+        profile : string, optional
+            The trajectory profile, None (default) to use the servo default profile.
+        """
+        self._servo.move(position, speed, steps, profile, retarget=True)
+        await self.wait()
+        return
+
+    async def wait(self):
+        """
+        Wait until the current movement is completed, stopped or retargeted.
+        """
+        future = self._loop.create_future()
+        self._servo.add_done_callback(lambda: self._loop.call_soon_threadsafe(_resolve, future))
+        await future
+        return
+
+    async def stop(self):
+        """
+        Stop the current movement.
+        """
+        self._servo.stop()
+        return
+
+
+class RobotAsyncPart:
+    """
+    This class implements the asyncio facade of a robot part, the head or the body.
+    """
+
+    def __init__ (self, part, loop):
+        """
+        Initialize the facade.
+
+        Parameters
+        ----------
+        part : RobotHead or RobotBody
+            The robot part to operate.
+        loop : asyncio.AbstractEventLoop
+            The event loop of the waiters.
+        """
+        self._part   = part
+        self._servos = {name : RobotAsyncServo(servo, loop) for name, servo in part.servos().items()}
+        return
+
+    def servo(self, joint):
+        """
+        Get the facade of a joint servo.
+
+        Parameters
+        ----------
+        joint : string
+            The joint name (i.e. "neck_LR").
+
+        Returns
+        -------
+        RobotAsyncServo
+            The servo facade.
+        """
+        return self._servos[joint]
+
+    def servos(self):
+        """
+        Get the facades of all the servos by joint name.
+
+        Returns
+        -------
+        dict
+            The servo facade of each joint.
+        """
+        return self._servos
+
+    async def wait(self):
+        """
+        Wait until all the movements of the part are completed.
+        """
+        await asyncio.gather(*[servo.wait() for servo in self._servos.values()])
+        return
+
+    async def stop(self):
+        """
+        Stop all the movements of the part.
+        """
+        for servo in self._servos.values():
+            await servo.stop()
+        return
+
+
+class RobotAsync:
+    """
+    This class implements the asyncio facade of the robot.
+    """
+
+    def __init__ (self, robot, loop=None):
+        """
+        Initialize the facade.
+
+        Parameters
+        ----------
+        robot : Robot
+            The robot to operate.
+        loop : asyncio.AbstractEventLoop, optional
+            The event loop of the waiters, None (default) for the running loop.
+        """
+        self._robot = robot
+        self._loop  = loop or asyncio.get_running_loop()
+        self._head  = RobotAsyncPart(robot.head(), self._loop)
+        self._body  = RobotAsyncPart(robot.body(), self._loop)
+        return
+
+    def robot(self):
+        """
+        Get the robot.
+
+        Returns
+        -------
+        Robot
+            The robot operated by the facade.
+        """
+        return self._robot
+
+    def head(self):
+        """
+        Get the head facade.
+
+        Returns
+        -------
+        RobotAsyncPart
+            The head facade.
+        """
+        return self._head
+
+    def body(self):
+        """
+        Get the body facade.
+
+        Returns
+        -------
+        RobotAsyncPart
+            The body facade.
+        """
+        return self._body
+
+    def joints(self):
+        """
+        Get the servo facades by joint name, named as Robot.joints().
+
+        Returns
+        -------
+        dict
+            The servo facade of each joint.
+        """
+        joints = {}
+        for name, servo in self._head.servos().items():
+            joints["head/" + name] = servo
+        for name, servo in self._body.servos().items():
+            joints["body/" + name] = servo
+        return joints
+
+    async def initialize(self):
+        """
+        Initialize the robot, off the event loop.
+        """
+        await self._loop.run_in_executor(None, self._robot.initialize)
+        return
+
+    async def shutdown(self):
+        """
+        Shutdown the robot, off the event loop since it waits for the pending movements.
+        """
+        await self._loop.run_in_executor(None, self._robot.shutdown)
+        return
+
+    async def pose(self, targets):
+        """
+        Move several joints within the same scheduler tick and wait until all of them are
+        completed.
+
+        Parameters
+        ----------
+        targets : dict
+            The (position, speed, steps) of each joint to move, by joint name.
+        """
+        self._robot.pose(targets)
+        joints = self.joints()
+        await asyncio.gather(*[joints[joint].wait() for joint in targets])
+        return
+
+    async def wait(self):
+        """
+        Wait until all the movements are completed.
+        """
+        await asyncio.gather(self._head.wait(), self._body.wait())
+        return
+
+    async def stop(self):
+        """
+        Stop all the movements.
+        """
+        await self._head.stop()
+        await self._body.stop()
+        return
+
+
+class RobotAsyncMQTT(RobotMQTT):
+    """
+    This class implements the robot MQTT interface on an asyncio event loop. The client socket
+    is served by the loop instead of a network thread, the immediate commands (moves, poses,
+    choreography starts) run inline on the loop since they never block, and only the long
+    commands (initialization, shutdown...) are handed over to an executor lane.
+    """
+
+    def __init__ (self, robot, library=None):
+        """
+        Initialize the interface, it must be created from a coroutine of the loop serving it.
+
+        Parameters
+        ----------
+        robot : Robot
+            The robot to operate, its servos must retarget their movements.
+        library : RobotChoreographyLibrary, optional
+            The choreographies that can be played, None (default) for none.
+        """
+        super().__init__(robot, library, RobotExecutor({"choreography" : 1}))
+        self._loop         = asyncio.get_running_loop()
+        self._misc         = None
+        self._disconnected = None
+        return
+
+    def on_message(self, client, msg):
+        """
+        Handle a message received from the broker, running the immediate commands inline.
+
+        Parameters
+        ----------
+        client : mqtt.Client
+            The MQTT client.
+        msg : mqtt.MQTTMessage
+            The received message.
+        """
+        route = self._router.lookup(msg.topic)
+        if (route is None) or (route[2] != "immediate"):
+            super().on_message(client, msg)
+            return
+        logging.debug("topic=%s payload=%s", msg.topic ,msg.payload)
+        handler, args, lane, coalesce = route
+        try:
+            handler(client, msg, *args)
+        except Exception:
+            logging.exception("command failed: %s", msg.topic)
+        return
+
+    async def run(self, client, host="localhost", port=1883, keepalive=60):
+        """
+        Connect to the broker, subscribe to the robot topics and serve the client socket until
+        it is disconnected on purpose (i.e. by the quit command), reconnecting whenever the
+        connection is lost.
+
+        Parameters
+        ----------
+        client : mqtt.Client
+            The MQTT client, its user data must be this interface.
+        host : string, optional
+            The broker host (default is "localhost").
+        port : int, optional
+            The broker port (default is 1883).
+        keepalive : int, optional
+            The keepalive period in seconds (default is 60).
+        """
+        self._disconnected = self._loop.create_future()
+
+        client.on_socket_open             = self._on_socket_open
+        client.on_socket_close            = self._on_socket_close
+        client.on_socket_register_write   = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        client.on_connect                 = self._on_connect
+        client.on_disconnect              = self._on_disconnect
+        client.on_message                 = on_message
+
+        client.connect(host, port, keepalive)
+        await self._disconnected
+        return
+
+    async def _misc_loop(self, client):
+        """
+        Run the client periodic work (keepalive, retries) while the socket is open.
+
+        Parameters
+        ----------
+        client : mqtt.Client
+            The MQTT client.
+        """
+        while client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1.0)
+        return
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._loop.add_reader(sock, client.loop_read)
+        self._misc = self._loop.create_task(self._misc_loop(client))
+        return
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._loop.remove_reader(sock)
+        if self._misc is not None:
+            self._misc.cancel()
+            self._misc = None
+        return
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        # the commands run by the executor lane (i.e. quit) may publish from its thread.
+        #
+        self._loop.call_soon_threadsafe(self._loop.add_writer, sock, client.loop_write)
+        return
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._loop.call_soon_threadsafe(self._loop.remove_writer, sock)
+        return
+
+    def _on_connect(self, client, userdata, flags, rc):
+        logging.info("connected: rc=%s", rc)
+        client.subscribe("robot/#")
+        return
+
+    def _on_disconnect(self, client, userdata, rc):
+        logging.info("disconnected: rc=%s", rc)
+        if rc == mqtt.MQTT_ERR_SUCCESS:
+            # requested disconnection, i.e. the quit command.
+            #
+            self._loop.call_soon_threadsafe(_resolve, self._disconnected)
+        else:
+            self._loop.call_soon_threadsafe(self._loop.create_task, self._reconnect(client))
+        return
+
+    async def _reconnect(self, client, delay=0.5, maximum=30.0):
+        """
+        Reconnect to the broker after an unexpected disconnection, doubling the delay between
+        the attempts up to a maximum.
+
+        Parameters
+        ----------
+        client : mqtt.Client
+            The MQTT client.
+        delay : float, optional
+            The delay before the first attempt in seconds (default is 0.5).
+        maximum : float, optional
+            The maximum delay between the attempts in seconds (default is 30.0).
+        """
+        while not self._disconnected.done():
+            await asyncio.sleep(delay)
+            try:
+                client.reconnect()
+                return
+            except OSError as e:
+                logging.warning("reconnect failed: %s, retrying in %ss.", e, min(delay * 2.0, maximum))
+            delay = min(delay * 2.0, maximum)
+        return
+
+
+async def run_telemetry(telemetry):
+    """
+    Publish the robot state from the event loop until cancelled.
+
+    Parameters
+    ----------
+    telemetry : RobotTelemetry
+        The robot state telemetry.
+    """
+    while True:
+        await asyncio.sleep(telemetry.period())
+        try:
+            telemetry.poll()
+        except Exception:
+            logging.exception("telemetry: publish failed.")
+
+async def main(args):
+    """
+    Run the robot daemon.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        The command line arguments.
+    """
+    # create the robot, the moves never block the loop.
+    #
+    robot = RobotAsync(Robot("walle", args.rate, "simulated" if args.simulate else "pca9685"))
+    robot.robot().set_retarget(True)
+    await robot.initialize()
+
+    # create the MQTT client and serve it until the robot quits.
+    #
+    cache     = RobotChoreographyCache(os.path.join(args.choreographies, ".cache"))
+    library   = RobotChoreographyLibrary(args.choreographies, args.rate, cache)
+    robotmqtt = RobotAsyncMQTT(robot.robot(), library)
+    client    = mqtt.Client(robot.robot().name(), True, robotmqtt)
+    telemetry = None
+    if args.telemetry > 0.0:
+        telemetry = asyncio.create_task(run_telemetry(RobotTelemetry(robot.robot(), client, args.telemetry)))
+    try:
+        await robotmqtt.run(client, args.host, args.port)
+    finally:
+        # park the robot however the daemon ends, the quit command already did it.
+        #
+        if telemetry is not None:
+            telemetry.cancel()
+        robotmqtt.player().stop()
+        await robot.shutdown()
+        robotmqtt.shutdown()
+    return
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Robot asyncio MQTT daemon.')
+    parser.add_argument('-d', '--debug', action="store_true", dest="debug", default=False, help="enable debug mode")
+    parser.add_argument('-s', '--simulate', action="store_true", dest="simulate", default=False, help="use the simulated servo board")
+    parser.add_argument('-r', '--rate', type=float, dest="rate", default=100.0, help="motion scheduler rate in Hz")
+    parser.add_argument('-t', '--telemetry', type=float, dest="telemetry", default=10.0, help="robot/state telemetry rate in Hz, 0 to disable")
+    parser.add_argument('-c', '--choreographies', dest="choreographies", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "choreographies"), help="choreographies directory")
+    parser.add_argument('-H', '--host', dest="host", default="localhost", help="broker host")
+    parser.add_argument('-p', '--port', type=int, dest="port", default=1883, help="broker port")
+    args = parser.parse_args()
+
+    format = "%(asctime)s: %(message)s"
+    if args.debug:
+        setup_logging(logging.DEBUG, format)
+    else:
+        setup_logging(logging.INFO, format)
+
+    asyncio.run(main(args))
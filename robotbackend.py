@@ -0,0 +1,225 @@
+import threading
+
+from robotclock import RobotClock
+
+# Available servo backends.
+#
+BACKENDS = ("pca9685", "simulated")
+
+class RobotServoBackend:
+    """
+    This class implements the servo board interface. The channel updates are buffered and
+    flushed once per scheduler tick, grouped in blocks of consecutive channels; the subclasses
+    only have to setup the board and send the blocks.
+    """
+
+    _BLOCK_CHANNELS = 8
+
+    def __init__ (self, globalLock, clock=None):
+        """
+        Initialize the servo board.
+
+        Parameters
+        ----------
+        globalLock :
+            The global thread lock to be used when writing to the board.
+        clock : RobotClock, optional
+            The clock used for the statistics, None (default) for the wall clock.
+
+        """
+        self._globalLock   = globalLock
+        self._clock        = clock if clock is not None else RobotClock()
+        self._lock         = threading.Lock()
+        self._pending      = {}
+        self._values       = {}
+        self._initialized  = False
+        self.reset_statistics()
+        return
+
+    def setup(self):
+        """
+        Setup the board, it is done only once.
+        """
+        self._globalLock.acquire()
+        if not self._initialized:
+            self._setup()
+            self._initialized = True
+        self._globalLock.release()
+        return
+
+    def write(self, channel, angle):
+        """
+        Buffer a channel update, it will be sent to the board on the next flush.
+
+        Parameters
+        ----------
+        channel : int
+            The servo channel.
+        angle : int
+            The servo angle in degrees.
+        """
+        self._lock.acquire()
+        self._pending[channel] = angle
+        self._updates = self._updates + 1
+        self._lock.release()
+        return
+
+    def pending(self):
+        """
+        Check if there are buffered channel updates.
+
+        Returns
+        -------
+        bool
+            True if a flush is needed.
+        """
+        self._lock.acquire()
+        pending = len(self._pending) > 0
+        self._lock.release()
+        return pending
+
+    def flush(self):
+        """
+        Send all the buffered channel updates to the board, one block for each run of
+        consecutive channels, with a single acquisition of the global lock.
+        """
+        self._lock.acquire()
+        pending = self._pending
+        self._pending = {}
+        self._values.update(pending)
+        values = dict(self._values)
+        self._lock.release()
+
+        if not pending:
+            return
+
+        blocks = self._blocks(sorted(pending), values)
+
+        self._globalLock.acquire()
+        self._send(blocks)
+        self._globalLock.release()
+
+        self._lock.acquire()
+        self._transactions = self._transactions + len(blocks)
+        self._flushes      = self._flushes + 1
+        self._lock.release()
+        return
+
+    def statistics(self):
+        """
+        Get the bus statistics since the last reset.
+
+        Returns
+        -------
+        dict
+            The number of channel updates, the bus transactions issued, the transactions that
+            the unbatched path would have issued (four register writes per update) and the
+            saved transactions per second.
+        """
+        self._lock.acquire()
+        elapsed   = self._clock.now() - self._since
+        unbatched = 4 * self._updates
+        saved     = unbatched - self._transactions
+        stats = {
+            "updates"          : self._updates,
+            "flushes"          : self._flushes,
+            "transactions"     : self._transactions,
+            "unbatched"        : unbatched,
+            "saved"            : saved,
+            "saved_per_second" : saved / elapsed if elapsed > 0.0 else 0.0,
+        }
+        self._lock.release()
+        return stats
+
+    def reset_statistics(self):
+        """
+        Reset the bus statistics.
+        """
+        self._updates      = 0
+        self._flushes      = 0
+        self._transactions = 0
+        self._since        = self._clock.now()
+        return
+
+    def _setup(self):
+        """
+        Setup the board hardware, called once with the global lock held.
+        """
+        raise NotImplementedError
+
+    def _send(self, blocks):
+        """
+        Send blocks of consecutive channels to the board, called with the global lock held.
+
+        Parameters
+        ----------
+        blocks : list
+            A list of (first channel, angles) tuples.
+        """
+        raise NotImplementedError
+
+    def _blocks(self, channels, values):
+        """
+        Group the channels to write into blocks. Gaps between channels are filled with their
+        last written value when it is known.
+
+        Parameters
+        ----------
+        channels : list
+            The sorted list of channels to write.
+        values : dict
+            The last angle written to each channel.
+
+        Returns
+        -------
+        list
+            A list of (first channel, angles) tuples.
+        """
+        blocks = []
+        first  = None
+        angles = []
+        last   = None
+        for channel in channels:
+            contiguous = (first is not None) and (channel - first < self._BLOCK_CHANNELS) and \
+                         all(c in values for c in range(last + 1, channel))
+            if not contiguous:
+                if first is not None:
+                    blocks.append((first, angles))
+                first  = channel
+                angles = []
+                last   = channel - 1
+            for c in range(last + 1, channel + 1):
+                angles.append(values[c])
+            last = channel
+        if first is not None:
+            blocks.append((first, angles))
+        return blocks
+
+
+def create_backend(kind, globalLock, address=0x40, clock=None):
+    """
+    Create a servo board backend, the hardware libraries are only imported when needed.
+
+    Parameters
+    ----------
+    kind : string
+        The backend kind, one of BACKENDS.
+    globalLock :
+        The global thread lock to be used when writing to the board.
+    address : int, optional
+        The I2C address of the board (default is 0x40).
+    clock : RobotClock, optional
+        The clock used to timestamp the simulated writes, None (default) for the wall clock.
+
+    Returns
+    -------
+    RobotServoBackend
+        The servo board backend.
+    """
+    if kind == "pca9685":
+        from robotpca9685 import RobotPCA9685
+        return RobotPCA9685(globalLock, address=address)
+    elif kind == "simulated":
+        from robotsimulator import RobotSimulatedPCA9685
+        return RobotSimulatedPCA9685(globalLock, address=address, clock=clock)
+    raise ValueError("invalid servo backend: {}".format(kind))
@@ -0,0 +1,345 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import numpy as np
+import paho.mqtt.client as mqtt
+
+from robot import Robot
+from robotmqtt import RobotMQTT
+from robotbroker import RobotFakeBroker, RobotFakeClient
+from robotpayload import encode_move
+from robotchoreography import RobotChoreographyCache, RobotChoreographyLibrary
+from robotlog import setup_logging
+
+# The message kinds of the load and their default mix (relative weights).
+#
+KINDS = ("move", "binary", "pose", "dance", "malformed")
+MIX   = "move=60,binary=20,pose=15,dance=1,malformed=4"
+
+class RobotErrorCounter(logging.Handler):
+    """
+    This class implements a logging handler that counts the errors, i.e. the malformed
+    commands rejected by the robot.
+    """
+
+    def __init__ (self):
+        """
+        Initialize the counter.
+        """
+        super().__init__(logging.ERROR)
+        self.count = 0
+        return
+
+    def emit(self, record):
+        """
+        Count an error record.
+        """
+        self.count = self.count + 1
+        return
+
+
+class RobotBench:
+    """
+    This class implements the MQTT load test: it generates a message mix, publishes it at a
+    given rate and measures how the robot message path copes with it.
+    """
+
+    def __init__ (self, robotmqtt, mix, seed=0):
+        """
+        Initialize the load test.
+
+        Parameters
+        ----------
+        robotmqtt : RobotMQTT
+            The robot MQTT interface under test, its routes are wrapped to time the dispatch.
+        mix : dict
+            The relative weight of each message kind (KINDS).
+        seed : int, optional
+            The random seed of the generated messages (default is 0).
+        """
+        self._robotmqtt = robotmqtt
+        self._random    = random.Random(seed)
+        self._kinds     = [kind for kind in KINDS if mix.get(kind, 0) > 0]
+        self._weights   = [mix[kind] for kind in self._kinds]
+        self._joints    = sorted(robotmqtt.robot().joints())
+        self._dances    = [topic for topic in robotmqtt.router().topics() if topic.startswith("robot/dance/") and topic != "robot/dance/stop"]
+        self._lock      = threading.Lock()
+        self._latencies = []
+        self._sent      = dict.fromkeys(KINDS, 0)
+        self._delivered = 0
+
+        # time the dispatch of every route: from the message reception to its handler.
+        #
+        router = robotmqtt.router()
+        for topic in router.topics():
+            handler, args, lane, coalesce = router.lookup(topic)
+            router.add(topic, self._timed(handler), *args, lane=lane, coalesce=coalesce)
+        return
+
+    def _timed(self, handler):
+        """
+        Wrap a route handler to record its dispatch latency.
+        """
+        def timed(client, msg, *args):
+            latency = time.monotonic() - msg.timestamp
+            self._lock.acquire()
+            self._latencies.append(latency)
+            self._lock.release()
+            return handler(client, msg, *args)
+        return timed
+
+    def on_message(self, client, msg):
+        """
+        Count a message delivered by the broker and hand it over to the robot MQTT interface.
+        The topics the robot publishes itself are not counted, only the load is.
+
+        Parameters
+        ----------
+        client : mqtt.Client or RobotFakeClient
+            The robot client.
+        msg : mqtt.MQTTMessage
+            The received message.
+        """
+        if not self._robotmqtt.router().ignored(msg.topic):
+            self._lock.acquire()
+            self._delivered = self._delivered + 1
+            self._lock.release()
+        self._robotmqtt.on_message(client, msg)
+        return
+
+    def delivered(self):
+        """
+        Get the number of load messages delivered to the robot.
+
+        Returns
+        -------
+        int
+            The number of messages delivered.
+        """
+        return self._delivered
+
+    def message(self):
+        """
+        Generate a message of the mix.
+
+        Returns
+        -------
+        tuple
+            The message kind, topic and payload.
+        """
+        kind  = self._random.choices(self._kinds, self._weights)[0]
+        joint = self._random.choice(self._joints)
+        if kind == "move":
+            return kind, "robot/{}/move".format(joint), "{:.3f}".format(self._random.random()).encode()
+        if kind == "binary":
+            return kind, "robot/move/bin", encode_move(joint, self._random.random())
+        if kind == "pose":
+            pose = {j : round(self._random.random(), 3) for j in self._random.sample(self._joints, 3)}
+            return kind, "robot/pose", json.dumps(pose).encode()
+        if kind == "dance":
+            return kind, self._random.choice(self._dances) if self._dances else "robot/dance/stop", b""
+        topic, payload = self._random.choice((
+            ("robot/{}/move".format(joint), b"not a position"),
+            ("robot/{}/move".format(joint), b"1.5"),
+            ("robot/pose",                  b"{\"head/nose\": 0.5}"),
+            ("robot/pose",                  b"{"),
+            ("robot/move/bin",              b"\x01\x00\x63"),
+            ("robot/unknown",               b"0.5"),
+        ))
+        return kind, topic, payload
+
+    def run(self, publisher, rate, duration):
+        """
+        Publish the load.
+
+        Parameters
+        ----------
+        publisher : mqtt.Client or RobotFakeClient
+            The client publishing the messages.
+        rate : float
+            The messages per second, 0.0 to publish as fast as possible.
+        duration : float
+            The load duration in seconds.
+
+        Returns
+        -------
+        int
+            The number of messages published.
+        """
+        count    = 0
+        start    = time.monotonic()
+        deadline = start
+        while deadline - start < duration:
+            kind, topic, payload = self.message()
+            publisher.publish(topic, payload)
+            self._sent[kind] = self._sent[kind] + 1
+            count = count + 1
+            if rate > 0.0:
+                deadline = deadline + 1.0 / rate
+                delay = deadline - time.monotonic()
+                if delay > 0.0:
+                    time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+        return count
+
+    def sent(self):
+        """
+        Get the number of messages published by kind.
+
+        Returns
+        -------
+        dict
+            The number of messages of each kind.
+        """
+        return dict(self._sent)
+
+    def latencies(self):
+        """
+        Get the dispatch latencies recorded.
+
+        Returns
+        -------
+        numpy.ndarray
+            The dispatch latencies in seconds.
+        """
+        self._lock.acquire()
+        latencies = np.array(self._latencies)
+        self._lock.release()
+        return latencies
+
+
+def on_message(client, bench, msg):
+    bench.on_message(client, msg)
+
+def parse_mix(mix):
+    """
+    Parse a message mix, i.e. "move=60,pose=20,malformed=20".
+
+    Parameters
+    ----------
+    mix : string
+        The comma separated kind=weight pairs.
+
+    Returns
+    -------
+    dict
+        The weight of each kind.
+
+    Raises
+    ------
+    ValueError
+        If the mix is not valid.
+    """
+    weights = {}
+    for item in mix.split(","):
+        kind, _, weight = item.partition("=")
+        if kind.strip() not in KINDS:
+            raise ValueError("invalid message kind: {}".format(kind))
+        weights[kind.strip()] = (float)(weight)
+    return weights
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Robot MQTT load test.')
+    parser.add_argument('-r', '--rate', type=float, dest="rate", default=1000.0, help="messages per second, 0 for as fast as possible")
+    parser.add_argument('-t', '--time', type=float, dest="duration", default=5.0, help="load duration in seconds")
+    parser.add_argument('-m', '--mix', dest="mix", default=MIX, help="message mix as kind=weight pairs, kinds: " + ", ".join(KINDS))
+    parser.add_argument('-H', '--host', dest="host", default=None, help="broker host (i.e. a local mosquitto), default is the in-process fake broker")
+    parser.add_argument('-p', '--port', type=int, dest="port", default=1883, help="broker port")
+    parser.add_argument('-b', '--blocking', action="store_true", dest="blocking", default=False, help="wait for the current move instead of retargeting it")
+    parser.add_argument('-s', '--seed', type=int, dest="seed", default=0, help="random seed of the messages")
+    parser.add_argument('-d', '--debug', action="store_true", dest="debug", default=False, help="show the robot logs")
+    args = parser.parse_args()
+
+    # the malformed commands are expected, count the errors instead of showing them.
+    #
+    errors = RobotErrorCounter()
+    if args.debug:
+        setup_logging(logging.DEBUG)
+    else:
+        logging.getLogger().setLevel(logging.ERROR)
+    logging.getLogger().addHandler(errors)
+
+    # create the robot on the simulated backend.
+    #
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "choreographies")
+    robot     = Robot("bench", backend="simulated")
+    robot.set_retarget(not args.blocking)
+    robot.initialize()
+    library   = RobotChoreographyLibrary(directory, 100.0, RobotChoreographyCache(os.path.join(directory, ".cache")))
+    robotmqtt = RobotMQTT(robot, library)
+    bench     = RobotBench(robotmqtt, parse_mix(args.mix), args.seed)
+
+    # connect the robot and the load publisher to the broker.
+    #
+    broker = None
+    if args.host is None:
+        broker    = RobotFakeBroker()
+        client    = RobotFakeClient(broker, bench)
+        publisher = RobotFakeClient(broker)
+    else:
+        client    = mqtt.Client(robot.name(), True, bench)
+        publisher = mqtt.Client()
+        client.connect(args.host, args.port, 60)
+        publisher.connect(args.host, args.port, 60)
+        client.loop_start()
+        publisher.loop_start()
+    client.on_message = on_message
+    client.subscribe("robot/#")
+    time.sleep(0.5)
+
+    # publish the load and wait until the executor lanes are drained.
+    #
+    wall = time.monotonic()
+    cpu  = time.process_time()
+    sent = bench.run(publisher, args.rate, args.duration)
+
+    # every message must have reached the robot (the broker queue or the network being empty
+    # does not mean it has been dispatched yet) before the lanes can be considered drained.
+    #
+    deadline = time.monotonic() + 10.0
+    while True:
+        time.sleep(0.05)
+        stats = robotmqtt.executor().statistics()
+        if (bench.delivered() >= sent) and all(lane["depth"] == 0 for lane in stats.values()):
+            break
+        if time.monotonic() > deadline:
+            print("timeout     : {} of {} messages delivered".format(bench.delivered(), sent))
+            break
+    wall = time.monotonic() - wall
+    cpu  = time.process_time() - cpu
+
+    if broker is None:
+        client.loop_stop()
+        publisher.loop_stop()
+        client.disconnect()
+        publisher.disconnect()
+    else:
+        broker.shutdown()
+    robotmqtt.shutdown()
+    robot.shutdown()
+
+    # report.
+    #
+    latencies = bench.latencies() * 1000.0
+    executed  = sum(lane["executed"]  for lane in stats.values())
+    coalesced = sum(lane["coalesced"] for lane in stats.values())
+    print("sent        : {} {}".format(sent, bench.sent()))
+    print("throughput  : {:.1f} msg/s ({:.1f} executed/s)".format(sent / wall, executed / wall))
+    if len(latencies) > 0:
+        print("dispatch    : p50={:.3f}ms p99={:.3f}ms max={:.3f}ms".format(*np.percentile(latencies, (50, 99, 100))))
+    print("executed    : {}".format(executed))
+    print("coalesced   : {}".format(coalesced))
+    print("dropped     : {} (not routed)".format(sent - executed - coalesced))
+    print("rejected    : {} (errors logged)".format(errors.count))
+    print("cpu/message : {:.1f}us ({:.1f}% of one core)".format(cpu / sent * 1e6, cpu / wall * 100.0))
+    print("bus         : {}".format(robot.board().statistics()))
+    for name, lane in stats.items():
+        print("lane {:<12}: max_depth={} mean_wait={:.3f}ms max_wait={:.3f}ms".format(name, lane["max_depth"], lane["mean_wait"] * 1000.0, lane["max_wait"] * 1000.0))
+    sys.exit(0)
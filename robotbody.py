@@ -3,20 +3,30 @@ import time
 import threading
 import logging
 from robotservo import RobotServo
+from robotscheduler import RobotScheduler
+from robotbackend import create_backend
+from robotlog import setup_logging
 
 class RobotBody:
     """
     This class implements the robot body methods.
     """
 
-    def __init__ (self, globalLock):
+    def __init__ (self, board, scheduler):
         """
         Initialize and instantiate the servo motors for the body.
+
+        Parameters
+        ----------
+        board : RobotServoBackend
+            The servo board the motors are connected to.
+        scheduler : RobotScheduler
+            The motion scheduler shared by all the servos.
         """
         self._initialized = False
-        self._neck        = RobotServo(2, 90, 180, globalLock)
-        self._leftArm     = RobotServo(1,100,   0, globalLock)
-        self._rightArm    = RobotServo(0,  0, 100, globalLock)
+        self._neck        = RobotServo(2, 90, 180, board, scheduler)
+        self._leftArm     = RobotServo(1,100,   0, board, scheduler)
+        self._rightArm    = RobotServo(0,  0, 100, board, scheduler)
         return
 
     def initialize(self):
@@ -39,18 +49,33 @@ class RobotBody:
             self._initialized = True
         return
     
-    def left_arm_move(self, position, speed=0.0, steps=10):
-        self._leftArm.move (position, speed, steps)
+    def left_arm_move(self, position, speed=0.0, steps=10, profile=None):
+        self._leftArm.move(position, speed, steps, profile)
         return
     
-    def right_arm_move(self, position, speed=0.0, steps=10):
-        self._rightArm.move (position, speed, steps)
+    def right_arm_move(self, position, speed=0.0, steps=10, profile=None):
+        self._rightArm.move(position, speed, steps, profile)
         return
 
-    def neck_move(self, position, speed=0.0, steps=10):
-        self._neck.move (position, speed, steps)
+    def neck_move(self, position, speed=0.0, steps=10, profile=None):
+        self._neck.move(position, speed, steps, profile)
         return
     
+    def servos(self):
+        """
+        Get the body servos by joint name.
+
+        Returns
+        -------
+        dict
+            The servo of each joint.
+        """
+        return {
+            "neck"      : self._neck,
+            "left_arm"  : self._leftArm,
+            "right_arm" : self._rightArm,
+        }
+
     def shutdown(self):
         if self._initialized:
             
@@ -73,11 +98,13 @@ class RobotBody:
 if __name__ == "__main__":
     
     format = "%(asctime)s: %(message)s"
-    logging.basicConfig(format=format, level=logging.DEBUG, datefmt="%H:%M:%S")
+    setup_logging(logging.DEBUG, format)
     
     globalLock = threading.Lock()
+    board      = create_backend("pca9685", globalLock)
+    scheduler  = RobotScheduler()
     
-    robotbody = RobotBody(globalLock)
+    robotbody = RobotBody(board, scheduler)
     robotbody.initialize()
     
     time.sleep(3)
@@ -95,4 +122,5 @@ if __name__ == "__main__":
     time.sleep(3)
     
     robotbody.shutdown()
+    scheduler.shutdown()
 
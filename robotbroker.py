@@ -0,0 +1,188 @@
+import time
+import queue
+import logging
+import threading
+import paho.mqtt.client as mqtt
+
+class RobotFakeBroker:
+    """
+    This class implements an in-process MQTT broker stand-in: the published messages are
+    queued and delivered by a single thread, playing the part of the network thread of the
+    subscribed clients. It is meant for tests and benchmarks, there is no QoS, retain nor
+    persistent session.
+    """
+
+    def __init__ (self):
+        """
+        Initialize the broker and start its delivery thread.
+        """
+        self._lock        = threading.Lock()
+        self._subscribers = []
+        self._queue       = queue.SimpleQueue()
+        self._published   = 0
+        self._delivered   = 0
+        self._thread      = threading.Thread(target=self.run, name="RobotFakeBroker")
+        self._thread.daemon = True
+        self._thread.start()
+        return
+
+    def subscribe(self, client, pattern):
+        """
+        Subscribe a client to a topic pattern.
+
+        Parameters
+        ----------
+        client : RobotFakeClient
+            The subscribing client.
+        pattern : string
+            The topic pattern, with the MQTT wildcards.
+        """
+        self._lock.acquire()
+        self._subscribers.append((pattern, client))
+        self._lock.release()
+        return
+
+    def unsubscribe(self, client):
+        """
+        Remove all the subscriptions of a client.
+
+        Parameters
+        ----------
+        client : RobotFakeClient
+            The client.
+        """
+        self._lock.acquire()
+        self._subscribers = [(p, c) for p, c in self._subscribers if c is not client]
+        self._lock.release()
+        return
+
+    def publish(self, topic, payload):
+        """
+        Queue a message for delivery.
+
+        Parameters
+        ----------
+        topic : string
+            The message topic.
+        payload : bytes
+            The message payload.
+        """
+        self._lock.acquire()
+        self._published = self._published + 1
+        self._lock.release()
+        self._queue.put((topic, payload))
+        return
+
+    def statistics(self):
+        """
+        Get the broker statistics.
+
+        Returns
+        -------
+        dict
+            The number of messages published, queued and delivered to the subscribers.
+        """
+        return {"published" : self._published, "queued" : self._queue.qsize(), "delivered" : self._delivered}
+
+    def shutdown(self):
+        """
+        Stop the delivery thread once the queued messages have been delivered.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        return
+
+    def run(self):
+        """
+        Delivery thread entry point.
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            topic, payload = item
+            self._lock.acquire()
+            subscribers = [client for pattern, client in self._subscribers if mqtt.topic_matches_sub(pattern, topic)]
+            self._lock.release()
+            for client in subscribers:
+                self._delivered = self._delivered + 1
+                client.deliver(topic, payload)
+        return
+
+
+class RobotFakeClient:
+    """
+    This class implements the subset of the paho client used by the robot, connected to a
+    RobotFakeBroker.
+    """
+
+    def __init__ (self, broker, userdata=None):
+        """
+        Initialize the client.
+
+        Parameters
+        ----------
+        broker : RobotFakeBroker
+            The broker to connect to.
+        userdata : object, optional
+            The user data passed to the callbacks (default is None).
+        """
+        self._broker      = broker
+        self._userdata    = userdata
+        self._connected   = True
+        self.on_message   = None
+        return
+
+    def subscribe(self, topic, qos=0):
+        """
+        Subscribe to a topic pattern.
+        """
+        self._broker.subscribe(self, topic)
+        return (mqtt.MQTT_ERR_SUCCESS, 0)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """
+        Publish a message, string payloads are encoded as UTF-8 like paho does.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        elif payload is None:
+            payload = b""
+        self._broker.publish(topic, payload)
+        return None
+
+    def disconnect(self):
+        """
+        Disconnect from the broker.
+        """
+        self._connected = False
+        self._broker.unsubscribe(self)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def is_connected(self):
+        """
+        Check whether the client is connected.
+        """
+        return self._connected
+
+    def deliver(self, topic, payload):
+        """
+        Deliver a message from the broker thread, stamped like paho does on reception.
+
+        Parameters
+        ----------
+        topic : string
+            The message topic.
+        payload : bytes
+            The message payload.
+        """
+        if self.on_message is None:
+            return
+        msg = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+        msg.payload   = payload
+        msg.timestamp = time.monotonic()
+        try:
+            self.on_message(self, self._userdata, msg)
+        except Exception:
+            logging.exception("fake client: on_message failed.")
+        return
@@ -0,0 +1,608 @@
+import os
+import re
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+import numpy as np
+
+# Supported keyframe easings.
+#
+EASINGS = ("linear", "step", "ease_in_out")
+
+class RobotChoreography:
+    """
+    This class implements a keyframe choreography compiled into per-joint sample arrays: the
+    position of every joint at each tick of a fixed sample rate.
+    """
+
+    def __init__ (self, name, keyframes, rate=100.0, duration=None):
+        """
+        Compile a choreography.
+
+        Parameters
+        ----------
+        name : string
+            The choreography name.
+        keyframes : list
+            The keyframes, dictionaries with the "joint" name, the "time" in seconds, the
+            "target" position and optionally the "easing" used to reach the target from the
+            previous keyframe of the same joint, one of EASINGS (default is "linear").
+        rate : float, optional
+            The sample rate in Hz (default is 100.0).
+        duration : float, optional
+            The choreography duration, None (default) for the time of the last keyframe.
+
+        Raises
+        ------
+        ValueError
+            If a keyframe easing is not valid or its target is not in the range [0.0, 1.0].
+
+        """
+        by_joint = {}
+        for keyframe in keyframes:
+            easing = keyframe.get("easing", "linear")
+            if easing not in EASINGS:
+                raise ValueError("invalid easing: {}".format(easing))
+            target = (float)(keyframe["target"])
+            if not (0.0 <= target <= 1.0):
+                raise ValueError("target out of range: {}".format(keyframe))
+            by_joint.setdefault(keyframe["joint"], []).append(
+                ((float)(keyframe["time"]), target, EASINGS.index(easing)))
+
+        if duration is None:
+            duration = max([keyframe[0] for frames in by_joint.values() for keyframe in frames] + [0.0])
+
+        self._name     = name
+        self._rate     = rate
+        self._duration = duration
+        self._joints   = sorted(by_joint)
+
+        # compile the samples, a NaN sample means that the joint is not driven yet.
+        #
+        times = np.arange((int)(np.ceil(duration * rate)) + 1) / rate
+        self._samples = np.empty((len(times), len(self._joints)), dtype=np.float32)
+        for column, joint in enumerate(self._joints):
+            self._samples[:, column] = _interpolate(sorted(by_joint[joint]), times)
+        return
+
+    @classmethod
+    def from_samples(cls, name, joints, samples, rate, duration):
+        """
+        Build a choreography from already compiled samples, without copying them.
+
+        Parameters
+        ----------
+        name : string
+            The choreography name.
+        joints : list
+            The joint names, in the order of the sample columns.
+        samples : numpy.ndarray
+            The position of each joint (columns) at each sample time (rows).
+        rate : float
+            The sample rate in Hz.
+        duration : float
+            The choreography duration.
+
+        Returns
+        -------
+        RobotChoreography
+            The choreography.
+        """
+        choreography = cls.__new__(cls)
+        choreography._name     = name
+        choreography._rate     = rate
+        choreography._duration = duration
+        choreography._joints   = list(joints)
+        choreography._samples  = samples
+        return choreography
+
+    @classmethod
+    def load(cls, path, rate=100.0):
+        """
+        Load and compile a choreography source file, a JSON object with the "keyframes" and
+        optionally the "duration". The choreography is named after the file.
+
+        Parameters
+        ----------
+        path : string
+            The choreography file path.
+        rate : float, optional
+            The sample rate in Hz (default is 100.0).
+
+        Returns
+        -------
+        RobotChoreography
+            The compiled choreography.
+        """
+        with open(path) as f:
+            source = json.load(f)
+        name = os.path.splitext(os.path.basename(path))[0]
+        return cls(name, source["keyframes"], rate, source.get("duration"))
+
+    def name(self):
+        """
+        Get the choreography name.
+
+        Returns
+        -------
+        string
+            The choreography name.
+        """
+        return self._name
+
+    def rate(self):
+        """
+        Get the sample rate.
+
+        Returns
+        -------
+        float
+            The sample rate in Hz.
+        """
+        return self._rate
+
+    def duration(self):
+        """
+        Get the choreography duration.
+
+        Returns
+        -------
+        float
+            The duration in seconds.
+        """
+        return self._duration
+
+    def joints(self):
+        """
+        Get the joints driven by the choreography.
+
+        Returns
+        -------
+        list
+            The joint names, in the order of the sample columns.
+        """
+        return self._joints
+
+    def samples(self):
+        """
+        Get the compiled samples.
+
+        Returns
+        -------
+        numpy.ndarray
+            The position of each joint (columns) at each sample time (rows).
+        """
+        return self._samples
+
+
+def _interpolate(keyframes, times):
+    """
+    Interpolate the keyframes of a joint at the sample times.
+
+    Parameters
+    ----------
+    keyframes : list
+        The (time, target, easing index) keyframes sorted by time.
+    times : numpy.ndarray
+        The sample times.
+
+    Returns
+    -------
+    numpy.ndarray
+        The joint position at each sample time, NaN before the first keyframe.
+    """
+    kt = np.array([keyframe[0] for keyframe in keyframes])
+    kv = np.array([keyframe[1] for keyframe in keyframes])
+    ke = np.array([keyframe[2] for keyframe in keyframes])
+
+    previous = np.searchsorted(kt, times, side="right") - 1
+    after    = np.minimum(previous + 1, len(kt) - 1)
+    current  = np.maximum(previous, 0)
+
+    span = kt[after] - kt[current]
+    tau  = np.where(span > 0.0, (times - kt[current]) / np.where(span > 0.0, span, 1.0), 0.0)
+    tau  = np.clip(tau, 0.0, 1.0)
+
+    easing = ke[after]
+    eased  = np.select(
+        [easing == EASINGS.index("step"), easing == EASINGS.index("ease_in_out")],
+        [np.zeros_like(tau), tau ** 3 * (10.0 - 15.0 * tau + 6.0 * tau * tau)],
+        tau)
+
+    positions = kv[current] + (kv[after] - kv[current]) * eased
+    return np.where(previous >= 0, positions, np.nan)
+
+
+class RobotChoreographyPlayer:
+    """
+    This class implements the choreography player. It is stepped by the motion scheduler, so
+    the playback runs on the motion clock and never blocks the caller.
+    """
+
+    def __init__ (self, robot):
+        """
+        Initialize the player.
+
+        Parameters
+        ----------
+        robot : Robot
+            The robot to drive.
+        """
+        self._robot        = robot
+        self._scheduler    = robot.scheduler()
+        self._lock         = threading.Lock()
+        self._choreography = None
+        self._servos       = []
+        self._start        = 0.0
+        self._index        = -1
+        self._samples      = 0
+        self._lateSum      = 0.0
+        self._lateMax      = 0.0
+        self._report       = None
+        return
+
+    def start(self, choreography, offset=0.0):
+        """
+        Start playing a choreography, replacing the one being played.
+
+        Parameters
+        ----------
+        choreography : RobotChoreography
+            The choreography to play.
+        offset : float, optional
+            The time to start playing from (default is 0.0).
+
+        Raises
+        ------
+        ValueError
+            If the choreography drives a joint the robot does not have or the offset is
+            negative.
+        """
+        if offset < 0.0:
+            raise ValueError("invalid choreography offset: {}".format(offset))
+        joints = self._robot.joints()
+        for joint in choreography.joints():
+            if joint not in joints:
+                raise ValueError("invalid choreography joint: {}".format(joint))
+        self._lock.acquire()
+        self._choreography = choreography
+        self._servos       = [joints[joint] for joint in choreography.joints()]
+        self._start        = self._scheduler.now() - offset
+        self._index        = -1
+        self._samples      = 0
+        self._lateSum      = 0.0
+        self._lateMax      = 0.0
+        self._lock.release()
+        logging.debug ("choreography(%s): start at %s.", choreography.name(), offset)
+        self._scheduler.activate(self)
+        return
+
+    def stop(self):
+        """
+        Stop playing, the joints stay where they are.
+        """
+        self._lock.acquire()
+        if self._choreography is not None:
+            logging.debug ("choreography(%s): stopped.", self._choreography.name())
+            self._choreography = None
+        self._lock.release()
+        return
+
+    def seek(self, offset):
+        """
+        Move the playback to a given time.
+
+        Parameters
+        ----------
+        offset : float
+            The choreography time to play from.
+
+        Raises
+        ------
+        ValueError
+            If the offset is negative.
+        """
+        if offset < 0.0:
+            raise ValueError("invalid choreography offset: {}".format(offset))
+        self._lock.acquire()
+        self._start = self._scheduler.now() - offset
+        self._index = -1
+        self._lock.release()
+        return
+
+    def playing(self):
+        """
+        Get the choreography being played.
+
+        Returns
+        -------
+        string
+            The choreography name, None if nothing is playing.
+        """
+        self._lock.acquire()
+        name = self._choreography.name() if self._choreography is not None else None
+        self._lock.release()
+        return name
+
+    def report(self):
+        """
+        Get the timing report of the last completed run.
+
+        Returns
+        -------
+        dict
+            The planned and measured duration, the samples played and skipped, and the mean
+            and maximum sample lateness in seconds. None if no run has completed yet.
+        """
+        self._lock.acquire()
+        report = self._report
+        self._lock.release()
+        return report
+
+    def step(self, now):
+        """
+        Play the sample due, called by the scheduler on every tick.
+
+        Parameters
+        ----------
+        now : float
+            The scheduler time of the current tick.
+
+        Returns
+        -------
+        bool
+            True if the choreography is still playing.
+        """
+        self._lock.acquire()
+        choreography = self._choreography
+        if choreography is None:
+            self._lock.release()
+            return False
+
+        elapsed = now - self._start
+        samples = choreography.samples()
+        index   = min(max((int)(elapsed * choreography.rate()), 0), len(samples) - 1)
+        if index != self._index:
+            # write the sample due, measuring how late it is.
+            #
+            late = elapsed - index / choreography.rate()
+            self._samples = self._samples + 1
+            self._lateSum = self._lateSum + late
+            self._lateMax = max(self._lateMax, late)
+            self._index   = index
+            for servo, position in zip(self._servos, samples[index]):
+                if not np.isnan(position):
+                    servo.move((float)(position), retarget=True)
+
+        playing = elapsed < choreography.duration()
+        if not playing:
+            self._report = {
+                "name"          : choreography.name(),
+                "planned"       : choreography.duration(),
+                "measured"      : elapsed,
+                "samples"       : self._samples,
+                "skipped"       : len(samples) - self._samples,
+                "mean_lateness" : self._lateSum / self._samples,
+                "max_lateness"  : self._lateMax,
+            }
+            self._choreography = None
+            logging.info ("choreography(%s): done, timing=%s", choreography.name(), self._report)
+        self._lock.release()
+        return playing
+
+
+class RobotChoreographyCache:
+    """
+    This class implements the compiled choreography cache. Every choreography is stored as a
+    fixed-layout binary file keyed by the hash of its source and sample rate, so editing the
+    source invalidates it, and the samples are played straight from the memory-mapped file.
+
+    The file layout, little-endian, is a header (magic, version, number of joints, number of
+    samples, rate and duration), the joint names separated by NUL characters and padded to 8
+    bytes, and the float32 samples row by row.
+    """
+
+    MAGIC   = b"RCHO"
+    VERSION = 1
+    HEADER  = struct.Struct("<4sHHIdd")
+
+    def __init__ (self, directory):
+        """
+        Initialize the cache.
+
+        Parameters
+        ----------
+        directory : string
+            The cache directory, created when the first choreography is compiled.
+        """
+        self._directory = directory
+        return
+
+    def directory(self):
+        """
+        Get the cache directory.
+
+        Returns
+        -------
+        string
+            The cache directory.
+        """
+        return self._directory
+
+    def path(self, source, rate=100.0):
+        """
+        Get the compiled file of a choreography source file.
+
+        Parameters
+        ----------
+        source : string
+            The choreography source file path.
+        rate : float, optional
+            The sample rate in Hz (default is 100.0).
+
+        Returns
+        -------
+        string
+            The compiled file path.
+        """
+        digest = hashlib.sha256()
+        with open(source, "rb") as f:
+            digest.update(f.read())
+        digest.update(struct.pack("<Hd", self.VERSION, rate))
+        name = os.path.splitext(os.path.basename(source))[0]
+        return os.path.join(self._directory, "{}-{}.rcho".format(name, digest.hexdigest()[:16]))
+
+    def compile(self, source, rate=100.0):
+        """
+        Compile a choreography source file into the cache, removing its stale compiled files.
+
+        Parameters
+        ----------
+        source : string
+            The choreography source file path.
+        rate : float, optional
+            The sample rate in Hz (default is 100.0).
+
+        Returns
+        -------
+        string
+            The compiled file path.
+        """
+        choreography = RobotChoreography.load(source, rate)
+        path  = self.path(source, rate)
+        names = b"\0".join([joint.encode("utf-8") for joint in choreography.joints()])
+        names = names + b"\0" * (-len(names) % 8)
+        samples = choreography.samples()
+
+        os.makedirs(self._directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, samples.shape[1], samples.shape[0],
+                                     choreography.rate(), choreography.duration()))
+            f.write(struct.pack("<I", len(names)))
+            f.write(names)
+            f.write(samples.astype("<f4").tobytes())
+        os.replace(temp, path)
+
+        stale = re.compile(re.escape(choreography.name()) + r"-[0-9a-f]{16}\.rcho")
+        for entry in os.listdir(self._directory):
+            if stale.fullmatch(entry) and entry != os.path.basename(path):
+                os.remove(os.path.join(self._directory, entry))
+        logging.debug ("choreography(%s): compiled to %s.", choreography.name(), path)
+        return path
+
+    def load(self, source, rate=100.0):
+        """
+        Load a choreography from the cache, compiling it first if its source has changed.
+
+        Parameters
+        ----------
+        source : string
+            The choreography source file path.
+        rate : float, optional
+            The sample rate in Hz (default is 100.0).
+
+        Returns
+        -------
+        RobotChoreography
+            The choreography, its samples mapped from the compiled file.
+
+        Raises
+        ------
+        ValueError
+            If the compiled file is not valid.
+        """
+        path = self.path(source, rate)
+        if not os.path.exists(path):
+            path = self.compile(source, rate)
+
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, columns, rows, rate, duration = self.HEADER.unpack_from(buffer, 0)
+        if (magic != self.MAGIC) or (version != self.VERSION):
+            raise ValueError("invalid compiled choreography: {}".format(path))
+        offset = self.HEADER.size
+        length = struct.unpack_from("<I", buffer, offset)[0]
+        offset = offset + 4
+        joints = [name.decode("utf-8") for name in buffer[offset:offset + length].rstrip(b"\0").split(b"\0")] if columns > 0 else []
+        offset = offset + length
+
+        samples = np.frombuffer(buffer, dtype="<f4", count=rows * columns, offset=offset).reshape(rows, columns)
+        name    = os.path.splitext(os.path.basename(source))[0]
+        return RobotChoreography.from_samples(name, joints, samples, rate, duration)
+
+class RobotChoreographyLibrary:
+    """
+    This class implements a library of choreographies loaded from a directory of source files.
+    """
+
+    def __init__ (self, directory, rate=100.0, cache=None):
+        """
+        Load all the choreographies of a directory.
+
+        Parameters
+        ----------
+        directory : string
+            The directory with the choreography source files (*.json).
+        rate : float, optional
+            The sample rate in Hz (default is 100.0).
+        cache : RobotChoreographyCache, optional
+            The compiled choreography cache, None (default) to compile them in memory.
+        """
+        self._choreographies = {}
+        if os.path.isdir(directory):
+            for entry in sorted(os.listdir(directory)):
+                if entry.endswith(".json"):
+                    try:
+                        if cache is not None:
+                            choreography = cache.load(os.path.join(directory, entry), rate)
+                        else:
+                            choreography = RobotChoreography.load(os.path.join(directory, entry), rate)
+                    except (OSError, ValueError, KeyError, struct.error) as e:
+                        logging.error ("invalid choreography %s: %s", entry, e)
+                        continue
+                    self._choreographies[choreography.name()] = choreography
+        return
+
+    def names(self):
+        """
+        Get the choreography names.
+
+        Returns
+        -------
+        list
+            The choreography names.
+        """
+        return list(self._choreographies)
+
+    def get(self, name):
+        """
+        Get a choreography by name.
+
+        Parameters
+        ----------
+        name : string
+            The choreography name.
+
+        Returns
+        -------
+        RobotChoreography
+            The choreography, None if there is none with that name.
+        """
+        return self._choreographies.get(name)
+
+if __name__ == "__main__":
+
+    # compile the choreographies of a directory into its cache.
+    #
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "choreographies")
+    rate      = (float)(sys.argv[2]) if len(sys.argv) > 2 else 100.0
+    cache     = RobotChoreographyCache(os.path.join(directory, ".cache"))
+    for entry in sorted(os.listdir(directory)):
+        if entry.endswith(".json"):
+            print(cache.compile(os.path.join(directory, entry), rate))
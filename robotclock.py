@@ -0,0 +1,123 @@
+import time
+import threading
+
+class RobotClock:
+    """
+    This class implements the wall clock used by the motion scheduler.
+    """
+
+    def now(self):
+        """
+        Get the current time.
+
+        Returns
+        -------
+        float
+            The monotonic time in seconds.
+        """
+        return time.monotonic()
+
+    def wait(self, cv, timeout):
+        """
+        Wait on a condition variable until notified or until a timeout expires, the
+        condition variable must be held by the caller.
+
+        Parameters
+        ----------
+        cv : threading.Condition
+            The condition variable to wait on.
+        timeout : float
+            The timeout in seconds.
+        """
+        cv.wait(timeout)
+        return
+
+    def sleep(self, seconds):
+        """
+        Sleep for a given time.
+
+        Parameters
+        ----------
+        seconds : float
+            The time to sleep in seconds.
+        """
+        time.sleep(seconds)
+        return
+
+
+class RobotVirtualClock(RobotClock):
+    """
+    This class implements a virtual clock: the time only advances when somebody waits or
+    sleeps on it, so the motion scheduler runs as fast as possible while the timestamps of
+    every tick stay exactly where they would be with the wall clock.
+    """
+
+    def __init__ (self, start=0.0):
+        """
+        Initialize the virtual clock.
+
+        Parameters
+        ----------
+        start : float, optional
+            The initial time in seconds (default is 0.0).
+
+        """
+        self._lock = threading.Lock()
+        self._now  = start
+        return
+
+    def now(self):
+        """
+        Get the current virtual time.
+
+        Returns
+        -------
+        float
+            The virtual time in seconds.
+        """
+        self._lock.acquire()
+        now = self._now
+        self._lock.release()
+        return now
+
+    def advance(self, seconds):
+        """
+        Advance the virtual time.
+
+        Parameters
+        ----------
+        seconds : float
+            The time to advance in seconds.
+        """
+        self._lock.acquire()
+        self._now = self._now + max(seconds, 0.0)
+        self._lock.release()
+        return
+
+    def wait(self, cv, timeout):
+        """
+        Advance the virtual time by the timeout, only yielding the condition variable so
+        that pending notifications are served.
+
+        Parameters
+        ----------
+        cv : threading.Condition
+            The condition variable held by the caller.
+        timeout : float
+            The timeout in seconds.
+        """
+        self.advance(timeout)
+        cv.wait(0.0)
+        return
+
+    def sleep(self, seconds):
+        """
+        Advance the virtual time without blocking.
+
+        Parameters
+        ----------
+        seconds : float
+            The time to sleep in seconds.
+        """
+        self.advance(seconds)
+        return
@@ -0,0 +1,202 @@
+import time
+import logging
+import threading
+import collections
+
+# Default lanes and their number of workers: the immediate moves and the long commands
+# (choreographies, initialization...) run on separate lanes, so the former never wait
+# behind the latter.
+#
+LANES = {"immediate" : 1, "choreography" : 1}
+
+class RobotExecutorLane:
+    """
+    This class implements an executor lane: a command queue served by its own workers.
+    """
+
+    def __init__ (self, name, workers):
+        """
+        Initialize the lane.
+
+        Parameters
+        ----------
+        name : string
+            The lane name.
+        workers : int
+            The number of worker threads.
+        """
+        self._name      = name
+        self._cv        = threading.Condition()
+        self._queue     = collections.deque()
+        self._latest    = {}
+        self._stale     = 0
+        self._shutdown  = False
+        self._submitted = 0
+        self._executed  = 0
+        self._maxDepth  = 0
+        self._coalesced = 0
+        self._waitSum   = 0.0
+        self._waitMax   = 0.0
+        self._threads   = [threading.Thread(target=self.run, name="RobotExecutor-{}-{}".format(name, i)) for i in range(workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        return
+
+    def submit(self, handler, args, key=None):
+        """
+        Enqueue a command. A command with a key replaces the command with the same key that
+        is still waiting in the queue: the older one is dropped and the new one is queued
+        last, so it never runs before the commands received in between.
+
+        Parameters
+        ----------
+        handler : callable
+            The command handler.
+        args : tuple
+            The handler arguments.
+        key : object, optional
+            The coalescing key (i.e. the joint), None (default) to never coalesce.
+        """
+        self._cv.acquire()
+        self._submitted = self._submitted + 1
+        stale = self._latest.get(key) if key is not None else None
+        if stale is not None:
+            # the older command is stale, mark it so the workers skip it.
+            #
+            stale[1] = None
+            self._stale     = self._stale + 1
+            self._coalesced = self._coalesced + 1
+        entry = [time.monotonic(), handler, args, key]
+        self._queue.append(entry)
+        if key is not None:
+            self._latest[key] = entry
+        self._maxDepth = max(self._maxDepth, len(self._queue) - self._stale)
+        self._cv.notify()
+        self._cv.release()
+        return
+
+    def shutdown(self):
+        """
+        Stop the workers once the queued commands have been executed.
+        """
+        self._cv.acquire()
+        self._shutdown = True
+        self._cv.notify_all()
+        self._cv.release()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        return
+
+    def statistics(self):
+        """
+        Get the lane statistics.
+
+        Returns
+        -------
+        dict
+            The current and maximum queue depth, the number of commands submitted, executed
+            and dropped as stale, and the mean and maximum time spent in the queue in seconds.
+        """
+        self._cv.acquire()
+        stats = {
+            "depth"     : len(self._queue) - self._stale,
+            "max_depth" : self._maxDepth,
+            "submitted" : self._submitted,
+            "executed"  : self._executed,
+            "coalesced" : self._coalesced,
+            "mean_wait" : self._waitSum / self._executed if self._executed > 0 else 0.0,
+            "max_wait"  : self._waitMax,
+        }
+        self._cv.release()
+        return stats
+
+    def run(self):
+        """
+        Worker thread entry point.
+        """
+        while True:
+            self._cv.acquire()
+            while (not self._queue) and (not self._shutdown):
+                self._cv.wait()
+            if not self._queue:
+                self._cv.release()
+                break
+            enqueued, handler, args, key = self._queue.popleft()
+            if handler is None:
+                self._stale = self._stale - 1
+                self._cv.release()
+                continue
+            if key is not None:
+                del self._latest[key]
+            wait = time.monotonic() - enqueued
+            self._executed = self._executed + 1
+            self._waitSum  = self._waitSum + wait
+            self._waitMax  = max(self._waitMax, wait)
+            self._cv.release()
+
+            try:
+                handler(*args)
+            except Exception:
+                logging.exception("executor(%s): command failed.", self._name)
+        return
+
+
+class RobotExecutor:
+    """
+    This class implements the command executor: the MQTT callback only enqueues the commands
+    and the lane workers run them off the network thread.
+    """
+
+    def __init__ (self, lanes=None):
+        """
+        Initialize the executor and start its workers.
+
+        Parameters
+        ----------
+        lanes : dict, optional
+            The number of workers of each lane, None (default) for LANES.
+        """
+        self._lanes = {}
+        for name, workers in (lanes or LANES).items():
+            self._lanes[name] = RobotExecutorLane(name, workers)
+        return
+
+    def submit(self, lane, handler, *args, key=None):
+        """
+        Enqueue a command in a lane.
+
+        Parameters
+        ----------
+        lane : string
+            The lane name.
+        handler : callable
+            The command handler, called as handler(*args).
+        *args :
+            The handler arguments.
+        key : object, optional
+            The coalescing key: a command replaces the queued command with the same key that
+            has not been executed yet. None (default) to never coalesce.
+        """
+        self._lanes[lane].submit(handler, args, key)
+        return
+
+    def shutdown(self):
+        """
+        Stop all the lanes once their queued commands have been executed.
+        """
+        for lane in self._lanes.values():
+            lane.shutdown()
+        return
+
+    def statistics(self):
+        """
+        Get the statistics of all the lanes.
+
+        Returns
+        -------
+        dict
+            The statistics of each lane.
+        """
+        return {name : lane.statistics() for name, lane in self._lanes.items()}
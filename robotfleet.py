@@ -0,0 +1,464 @@
+import os
+import logging
+import argparse
+import threading
+import multiprocessing
+import paho.mqtt.client as mqtt
+
+from robot import Robot
+from robotrouter import RobotRouter
+from robotexecutor import RobotExecutor
+from robotmqtt import RobotMQTT, dispatch
+from robottelemetry import RobotTelemetry
+from robotchoreography import RobotChoreographyCache, RobotChoreographyLibrary
+from robotlog import setup_logging
+
+# The topic of the fleet quit command.
+#
+QUIT_TOPIC = "robot/quit"
+
+def parse_robot(spec):
+    """
+    Parse a fleet robot, i.e. "walle:0x40".
+
+    Parameters
+    ----------
+    spec : string
+        The robot name and optionally its servo board I2C address (default is 0x40).
+
+    Returns
+    -------
+    tuple
+        The robot name and board address.
+
+    Raises
+    ------
+    ValueError
+        If the robot is not valid.
+    """
+    name, _, address = spec.partition(":")
+    if (not name) or ("/" in name) or ("+" in name) or ("#" in name):
+        raise ValueError("invalid robot name: {}".format(name))
+    return name, (int)(address, 0) if address else 0x40
+
+def parse_robots(specs):
+    """
+    Parse the fleet robots, i.e. ["walle:0x40", "eve:0x41"].
+
+    Parameters
+    ----------
+    specs : list
+        The robots, see parse_robot.
+
+    Returns
+    -------
+    list
+        The name and board address of each robot.
+
+    Raises
+    ------
+    ValueError
+        If a robot is not valid, or two robots have the same name or board address.
+    """
+    robots = [parse_robot(spec) for spec in specs]
+    for i, (name, address) in enumerate(robots):
+        for other, otherAddress in robots[:i]:
+            if other == name:
+                raise ValueError("duplicate robot name: {}".format(name))
+            if otherAddress == address:
+                raise ValueError("duplicate robot address: {:#x} ({} and {})".format(address, other, name))
+    return robots
+
+def on_fleet_quit(client, msg, fleet):
+    """
+    Shutdown all the robots of the fleet and terminate.
+    """
+    fleet.shutdown_robots()
+    client.disconnect()
+    return
+
+
+class RobotFleet:
+    """
+    This class implements a fleet of robots hosted in the same process: every robot has its
+    own servo board and motion scheduler, and its commands are prefixed by "robot/<name>/".
+    The robots share the MQTT connection, the topic router and the command executor.
+    """
+
+    def __init__ (self, robots, rate=100.0, backend="pca9685", library=None, retarget=True):
+        """
+        Create the robots and register their topics.
+
+        Parameters
+        ----------
+        robots : list
+            The (name, board address) of each robot.
+        rate : float, optional
+            The motion scheduler tick rate in Hz (default is 100.0).
+        backend : string, optional
+            The servo board backend (default is "pca9685").
+        library : RobotChoreographyLibrary, optional
+            The choreographies the robots can play, None (default) for none.
+        retarget : bool, optional
+            True (default) to retarget the current moves instead of waiting for them.
+        """
+        self._router     = RobotRouter()
+        self._executor   = RobotExecutor()
+        self._units      = []
+        self._telemetry  = []
+        for name, address in robots:
+            robot = Robot(name, rate, backend, address=address)
+            robot.set_retarget(retarget)
+            self._units.append(RobotMQTT(robot, library, self._executor, "robot/{}/".format(name), self._router))
+        self._router.add(QUIT_TOPIC, on_fleet_quit, self, lane="choreography")
+        return
+
+    def robots(self):
+        """
+        Get the robots of the fleet.
+
+        Returns
+        -------
+        list
+            The robots.
+        """
+        return [unit.robot() for unit in self._units]
+
+    def router(self):
+        """
+        Get the shared topic router.
+
+        Returns
+        -------
+        RobotRouter
+            The topic router.
+        """
+        return self._router
+
+    def executor(self):
+        """
+        Get the shared command executor.
+
+        Returns
+        -------
+        RobotExecutor
+            The command executor.
+        """
+        return self._executor
+
+    def initialize(self):
+        """
+        Initialize all the robots at the same time, their initial moves take a few seconds.
+        """
+        threads = [threading.Thread(target=unit.robot().initialize) for unit in self._units]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return
+
+    def start_telemetry(self, client, rate):
+        """
+        Publish the state of every robot on "robot/<name>/state".
+
+        Parameters
+        ----------
+        client : mqtt.Client
+            The MQTT client publishing the state.
+        rate : float
+            The telemetry rate in Hz.
+        """
+        for unit in self._units:
+            telemetry = RobotTelemetry(unit.robot(), client, rate, unit.prefix() + "state")
+            telemetry.start()
+            self._telemetry.append(telemetry)
+        return
+
+    def on_message(self, client, msg):
+        """
+        Handle a message received from the broker.
+
+        Parameters
+        ----------
+        client : mqtt.Client
+            The MQTT client.
+        msg : mqtt.MQTTMessage
+            The received message.
+        """
+        dispatch(self._router, self._executor, client, msg)
+        return
+
+    def shutdown_robots(self):
+        """
+        Stop the choreographies and shutdown all the robots.
+        """
+        for unit in self._units:
+            unit.player().stop()
+            unit.robot().shutdown()
+        return
+
+    def shutdown(self):
+        """
+        Stop the telemetry and the command executor.
+        """
+        for telemetry in self._telemetry:
+            telemetry.stop()
+        self._telemetry = []
+        self._executor.shutdown()
+        logging.info('executor statistics: %s', self._executor.statistics())
+        return
+
+
+class RobotShardClient:
+    """
+    This class implements the MQTT client of a shard process: the messages it publishes are
+    handed over to the parent process, that owns the broker connection.
+    """
+
+    def __init__ (self, outbox):
+        """
+        Initialize the client.
+
+        Parameters
+        ----------
+        outbox : multiprocessing.Queue
+            The queue of the messages to publish.
+        """
+        self._outbox = outbox
+        return
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """
+        Publish a message through the parent process.
+        """
+        self._outbox.put((topic, payload, qos, retain))
+        return None
+
+    def disconnect(self):
+        """
+        Nothing to do, the parent process owns the connection.
+        """
+        return mqtt.MQTT_ERR_SUCCESS
+
+
+def run_shard(robots, rate, backend, directory, retarget, telemetry, level, inbox, outbox):
+    """
+    Shard process entry point: host some robots of the fleet, running the messages forwarded
+    by the parent process until it sends None.
+
+    Parameters
+    ----------
+    robots : list
+        The (name, board address) of the robots of the shard.
+    rate : float
+        The motion scheduler tick rate in Hz.
+    backend : string
+        The servo board backend.
+    directory : string
+        The choreographies directory.
+    retarget : bool
+        True to retarget the current moves instead of waiting for them.
+    telemetry : float
+        The telemetry rate in Hz, 0.0 to disable it.
+    level : int
+        The logging level.
+    inbox : multiprocessing.Queue
+        The (topic, payload, timestamp) of the forwarded messages.
+    outbox : multiprocessing.Queue
+        The messages to publish.
+    """
+    setup_logging(level)
+    library = RobotChoreographyLibrary(directory, rate, RobotChoreographyCache(os.path.join(directory, ".cache")))
+    fleet   = RobotFleet(robots, rate, backend, library, retarget)
+    client  = RobotShardClient(outbox)
+    fleet.initialize()
+    if telemetry > 0.0:
+        fleet.start_telemetry(client, telemetry)
+
+    while True:
+        item = inbox.get()
+        if item is None:
+            break
+        topic, payload, timestamp = item
+        msg = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+        msg.payload   = payload
+        msg.timestamp = timestamp
+        fleet.on_message(client, msg)
+
+    fleet.shutdown_robots()
+    fleet.shutdown()
+    return
+
+
+class RobotFleetShards:
+    """
+    This class implements a fleet sharded across worker processes, so a busy robot motion
+    loop cannot starve the others. The parent process owns the broker connection and forwards
+    every message to the shard hosting its robot.
+    """
+
+    def __init__ (self, robots, shards, rate=100.0, backend="pca9685", directory="choreographies", retarget=True, telemetry=0.0):
+        """
+        Start the shard processes, the robots are spread round robin.
+
+        Parameters
+        ----------
+        robots : list
+            The (name, board address) of each robot.
+        shards : int
+            The number of shard processes.
+        rate : float, optional
+            The motion scheduler tick rate in Hz (default is 100.0).
+        backend : string, optional
+            The servo board backend (default is "pca9685").
+        directory : string, optional
+            The choreographies directory.
+        retarget : bool, optional
+            True (default) to retarget the current moves instead of waiting for them.
+        telemetry : float, optional
+            The telemetry rate in Hz, 0.0 (default) to disable it.
+        """
+        shards        = max(min(shards, len(robots)), 1)
+        self._outbox  = multiprocessing.Queue()
+        self._inboxes = [multiprocessing.Queue() for i in range(shards)]
+        self._shardOf = {}
+        self._workers = []
+        for i in range(shards):
+            members = robots[i::shards]
+            for name, address in members:
+                self._shardOf[name] = self._inboxes[i]
+            worker = multiprocessing.Process(target=run_shard, name="RobotShard-{}".format(i),
+                                             args=(members, rate, backend, directory, retarget, telemetry, logging.getLogger().level, self._inboxes[i], self._outbox))
+            worker.start()
+            self._workers.append(worker)
+        self._client = None
+        self._pump   = None
+        return
+
+    def start(self, client):
+        """
+        Start publishing the messages of the shards.
+
+        Parameters
+        ----------
+        client : mqtt.Client
+            The MQTT client connected to the broker.
+        """
+        self._client = client
+        self._pump   = threading.Thread(target=self.run, name="RobotFleetPump")
+        self._pump.daemon = True
+        self._pump.start()
+        return
+
+    def on_message(self, client, msg):
+        """
+        Forward a message to the shard of its robot, the quit command disconnects the client
+        so the main thread terminates them all.
+
+        Parameters
+        ----------
+        client : mqtt.Client
+            The MQTT client.
+        msg : mqtt.MQTTMessage
+            The received message.
+        """
+        if msg.topic == QUIT_TOPIC:
+            # only stop the network loop, the shards are terminated by the main thread.
+            #
+            client.disconnect()
+            return
+        if msg.topic.endswith("/ack") or msg.topic.endswith("/state"):
+            return
+        parts = msg.topic.split("/", 2)
+        inbox = self._shardOf.get(parts[1]) if len(parts) == 3 else None
+        if inbox is None:
+            logging.error('invalid command: "%s"', msg.topic)
+            return
+        inbox.put((msg.topic, msg.payload, msg.timestamp))
+        return
+
+    def shutdown(self):
+        """
+        Terminate the shards once their queued messages have been handled, nothing to do if
+        they are already terminated.
+        """
+        if not self._workers:
+            return
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        self._outbox.put(None)
+        return
+
+    def run(self):
+        """
+        Publishing thread entry point.
+        """
+        while True:
+            item = self._outbox.get()
+            if item is None:
+                break
+            topic, payload, qos, retain = item
+            self._client.publish(topic, payload, qos, retain)
+        return
+
+
+# The callback for when a PUBLISH message is received from the server.
+#
+def on_message(client, fleet, msg):
+    fleet.on_message(client, msg)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Robot fleet MQTT Interface.')
+    parser.add_argument('robots', nargs="+", help="fleet robots as name[:i2c address], i.e. walle:0x40 eve:0x41")
+    parser.add_argument('-d', '--debug', action="store_true", dest="debug", default=False, help="enable debug mode")
+    parser.add_argument('-b', '--blocking', action="store_true", dest="blocking", default=False, help="wait for the current move instead of retargeting it")
+    parser.add_argument('-s', '--simulate', action="store_true", dest="simulate", default=False, help="use the simulated servo boards")
+    parser.add_argument('-r', '--rate', type=float, dest="rate", default=100.0, help="motion scheduler rate in Hz")
+    parser.add_argument('-t', '--telemetry', type=float, dest="telemetry", default=10.0, help="robot/<name>/state telemetry rate in Hz, 0 to disable")
+    parser.add_argument('-c', '--choreographies', dest="choreographies", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "choreographies"), help="choreographies directory")
+    parser.add_argument('-j', '--shards', type=int, dest="shards", default=0, help="number of worker processes, 0 to host all the robots in this process")
+    parser.add_argument('-H', '--host', dest="host", default="localhost", help="broker host")
+    parser.add_argument('-p', '--port', type=int, dest="port", default=1883, help="broker port")
+    args = parser.parse_args()
+
+    format = "%(asctime)s: %(message)s"
+    if args.debug:
+        setup_logging(logging.DEBUG, format)
+    else:
+        setup_logging(logging.INFO, format)
+
+    try:
+        robots = parse_robots(args.robots)
+    except ValueError as e:
+        parser.error(str(e))
+    backend = "simulated" if args.simulate else "pca9685"
+
+    # create the fleet, in this process or sharded.
+    #
+    if args.shards > 0:
+        fleet = RobotFleetShards(robots, args.shards, args.rate, backend, args.choreographies, not args.blocking, args.telemetry)
+    else:
+        library = RobotChoreographyLibrary(args.choreographies, args.rate, RobotChoreographyCache(os.path.join(args.choreographies, ".cache")))
+        fleet   = RobotFleet(robots, args.rate, backend, library, not args.blocking)
+        fleet.initialize()
+
+    # one connection for the whole fleet.
+    #
+    client = mqtt.Client("fleet", True, fleet)
+    client.connect(args.host, args.port, 60)
+    client.on_message = on_message
+    client.subscribe("robot/#")
+
+    if args.shards > 0:
+        fleet.start(client)
+    elif args.telemetry > 0.0:
+        fleet.start_telemetry(client, args.telemetry)
+
+    # Blocking call that processes network traffic, dispatches callbacks and handles reconnecting.
+    #
+    client.loop_forever()
+    fleet.shutdown()
@@ -3,22 +3,31 @@ import time
 import threading
 import logging
 from robotservo import RobotServo
+from robotscheduler import RobotScheduler
+from robotbackend import create_backend
+from robotlog import setup_logging
 
 class RobotHead:
     """
     This class implements the robot head methods.
     """
 
-    def __init__ (self, globalLock):
+    def __init__ (self, board, scheduler):
         """
         Initialize and instantiate the servo motors for the head.
+
+        Parameters
+        ----------
+        board : RobotServoBackend
+            The servo board the motors are connected to.
+        scheduler : RobotScheduler
+            The motion scheduler shared by all the servos.
         """
         self._initialized = False
-        self._globalLock  = globalLock
-        self._leftEye     = RobotServo(5, 75, 50, globalLock)
-        self._rightEye    = RobotServo(6,120,150, globalLock)
-        self._neckUD      = RobotServo(3,90,130, globalLock)
-        self._neckLR      = RobotServo(4,0,180, globalLock)
+        self._leftEye     = RobotServo(5, 75, 50, board, scheduler)
+        self._rightEye    = RobotServo(6,120,150, board, scheduler)
+        self._neckUD      = RobotServo(3,90,130, board, scheduler)
+        self._neckLR      = RobotServo(4,0,180, board, scheduler)
         return
 
     def initialize(self):
@@ -45,23 +54,39 @@ class RobotHead:
             self._initialized = True
         return
     
-    def left_eye_move(self, position, speed=0.0, steps=10):
-        self._leftEye.move(position, speed, steps)
+    def left_eye_move(self, position, speed=0.0, steps=10, profile=None):
+        self._leftEye.move(position, speed, steps, profile)
         return
     
 
-    def right_eye_move(self, position, speed=0.0, steps=10):
-        self._rightEye.move(position, speed, steps)
+    def right_eye_move(self, position, speed=0.0, steps=10, profile=None):
+        self._rightEye.move(position, speed, steps, profile)
         return
     
-    def neck_UD_move(self, position, speed=0.0, steps=10):
-        self._neckUD.move(position, speed, steps)
+    def neck_UD_move(self, position, speed=0.0, steps=10, profile=None):
+        self._neckUD.move(position, speed, steps, profile)
         return
 
-    def neck_LR_move(self,  position, speed=0.0, steps=10):
-        self._neckLR.move(position, speed, steps)
+    def neck_LR_move(self, position, speed=0.0, steps=10, profile=None):
+        self._neckLR.move(position, speed, steps, profile)
         return
     
+    def servos(self):
+        """
+        Get the head servos by joint name.
+
+        Returns
+        -------
+        dict
+            The servo of each joint.
+        """
+        return {
+            "left_eye"  : self._leftEye,
+            "right_eye" : self._rightEye,
+            "neck_UD"   : self._neckUD,
+            "neck_LR"   : self._neckLR,
+        }
+
     def shutdown(self):
         if self._initialized:
             
@@ -86,11 +111,13 @@ class RobotHead:
 if __name__ == "__main__":
 
     format = "%(asctime)s: %(message)s"
-    logging.basicConfig(format=format, level=logging.DEBUG, datefmt="%H:%M:%S")
+    setup_logging(logging.DEBUG, format)
     
     globalLock = threading.Lock()
+    board      = create_backend("pca9685", globalLock)
+    scheduler  = RobotScheduler()
     
-    robothead = RobotHead(globalLock)
+    robothead = RobotHead(board, scheduler)
     robothead.initialize()
     
     robothead.right_eye_move(1.0)
@@ -106,6 +133,7 @@ if __name__ == "__main__":
     time.sleep(3)
     
     robothead.shutdown()
+    scheduler.shutdown()
 
 
     
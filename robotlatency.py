@@ -0,0 +1,167 @@
+import sys
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+import numpy as np
+import paho.mqtt.client as mqtt
+
+from robotack import ACK_TOPIC
+from robotlog import setup_logging
+
+# The latency stages computed from each acknowledgement: (name, from, to).
+#
+STAGES = (
+    ("network",    "client_ts",  "received"),
+    ("queue",      "received",   "dispatched"),
+    ("write",      "client_ts",  "first_write"),
+    ("complete",   "client_ts",  "completed"),
+    ("round_trip", "client_ts",  "acked"),
+)
+
+# The reported percentiles.
+#
+PERCENTILES = (50, 90, 99, 100)
+
+class RobotLatency:
+    """
+    This class implements the command latency client: it collects the robot acknowledgements
+    and aggregates their timestamps into latency percentiles per stage.
+    """
+
+    def __init__ (self, prefix=None):
+        """
+        Initialize the collector.
+
+        Parameters
+        ----------
+        prefix : string, optional
+            Only collect the acknowledgements whose id starts with this prefix, None (default)
+            to collect all of them.
+        """
+        self._prefix = prefix
+        self._lock   = threading.Lock()
+        self._acks   = []
+        return
+
+    def on_ack(self, payload):
+        """
+        Collect an acknowledgement.
+
+        Parameters
+        ----------
+        payload : bytes
+            The acknowledgement payload.
+        """
+        acked = time.time()
+        try:
+            ack = json.loads(payload)
+        except ValueError:
+            logging.error("invalid ack: %s", payload)
+            return
+        if not isinstance(ack, dict):
+            logging.error("invalid ack: %s", payload)
+            return
+        if (self._prefix is not None) and not str(ack.get("id")).startswith(self._prefix):
+            return
+        ack["acked"] = acked
+        self._lock.acquire()
+        self._acks.append(ack)
+        self._lock.release()
+        return
+
+    def count(self):
+        """
+        Get the number of acknowledgements collected.
+
+        Returns
+        -------
+        int
+            The number of acknowledgements.
+        """
+        self._lock.acquire()
+        count = len(self._acks)
+        self._lock.release()
+        return count
+
+    def report(self):
+        """
+        Aggregate the acknowledgements collected.
+
+        Returns
+        -------
+        dict
+            The latency percentiles (PERCENTILES) in milliseconds and the number of samples of
+            each stage (STAGES). A stage without samples is omitted.
+        """
+        self._lock.acquire()
+        acks = list(self._acks)
+        self._lock.release()
+
+        report = {}
+        for name, start, end in STAGES:
+            samples = np.array([ack[end] - ack[start] for ack in acks
+                                if (ack.get(start) is not None) and (ack.get(end) is not None)])
+            if len(samples) > 0:
+                values = np.percentile(samples * 1000.0, PERCENTILES)
+                report[name] = dict(zip(["p{}".format(p) for p in PERCENTILES], values.round(3).tolist()))
+                report[name]["samples"] = len(samples)
+        return report
+
+
+def on_message(client, latency, msg):
+    latency.on_ack(msg.payload)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Robot command latency measurement.')
+    parser.add_argument('-H', '--host', dest="host", default="localhost", help="broker host")
+    parser.add_argument('-p', '--port', type=int, dest="port", default=1883, help="broker port")
+    parser.add_argument('-t', '--topic', dest="topic", default="robot/head/neck_LR/move", help="joint move topic to send the commands to")
+    parser.add_argument('-n', '--count', type=int, dest="count", default=100, help="number of commands to send")
+    parser.add_argument('-r', '--rate', type=float, dest="rate", default=10.0, help="commands per second")
+    parser.add_argument('-w', '--wait', type=float, dest="wait", default=2.0, help="seconds to wait for the last acknowledgements")
+    parser.add_argument('-l', '--listen', type=float, dest="listen", default=0.0, help="only listen to the acknowledgements of other clients for this many seconds")
+    args = parser.parse_args()
+
+    setup_logging(logging.INFO)
+
+    # collect our own acknowledgements, or all of them when listening.
+    #
+    prefix  = None if args.listen > 0.0 else uuid.uuid4().hex[:8] + "-"
+    latency = RobotLatency(prefix)
+    client  = mqtt.Client(userdata=latency)
+    client.on_message = on_message
+    client.connect(args.host, args.port, 60)
+    client.subscribe([(ACK_TOPIC, 0), ("robot/+/ack", 0)])
+    client.loop_start()
+
+    if args.listen > 0.0:
+        time.sleep(args.listen)
+        sent = None
+    else:
+        # send the commands, alternating the joint between both ends so every move writes.
+        #
+        period   = 1.0 / args.rate
+        deadline = time.monotonic()
+        for i in range(args.count):
+            command = {"position" : float(i % 2), "id" : "{}{}".format(prefix, i), "ts" : time.time()}
+            client.publish(args.topic, json.dumps(command))
+            deadline = deadline + period
+            time.sleep(max(deadline - time.monotonic(), 0.0))
+        sent = args.count
+        time.sleep(args.wait)
+
+    client.loop_stop()
+    client.disconnect()
+
+    # report the percentiles.
+    #
+    report = latency.report()
+    print("acks: {}{}".format(latency.count(), " of {} sent".format(sent) if sent is not None else ""))
+    for name, start, end in STAGES:
+        if name in report:
+            print("{:<10} {}".format(name, " ".join("{}={}ms".format(k, v) for k, v in report[name].items() if k != "samples")))
+    sys.exit(0)
@@ -0,0 +1,83 @@
+import sys
+import queue
+import atexit
+import logging
+import logging.handlers
+
+class RobotQueueHandler(logging.handlers.QueueHandler):
+    """
+    This class implements a queue handler that does not format the records: the message and
+    its arguments are handed over as they are and the formatting is done by the listener
+    thread, outside the servo and MQTT hot paths.
+    """
+
+    def prepare(self, record):
+        """
+        Prepare a record for the queue without formatting its message.
+
+        Parameters
+        ----------
+        record : logging.LogRecord
+            The record to enqueue.
+
+        Returns
+        -------
+        logging.LogRecord
+            The record to enqueue.
+        """
+        return record
+
+
+# The running queue listener.
+#
+_listener = None
+
+def setup_logging(level=logging.INFO, format="%(asctime)s: %(message)s", datefmt="%H:%M:%S"):
+    """
+    Configure the root logger to send the records through a queue to a background thread
+    that formats and writes them to the console.
+
+    Parameters
+    ----------
+    level : int, optional
+        The logging level (default is logging.INFO).
+    format : string, optional
+        The record format.
+    datefmt : string, optional
+        The date format.
+
+    Returns
+    -------
+    logging.handlers.QueueListener
+        The listener writing the records.
+    """
+    global _listener
+
+    shutdown_logging()
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(format, datefmt))
+
+    records = queue.SimpleQueue()
+    root    = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(RobotQueueHandler(records))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+    return _listener
+
+def shutdown_logging():
+    """
+    Stop the background logging thread, writing the pending records.
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    return
+
+atexit.register(shutdown_logging)
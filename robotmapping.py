@@ -0,0 +1,210 @@
+import json
+
+class RobotMapping:
+    """
+    This class implements a declarative controller mapping: each entry maps a set of modifier
+    buttons and an axis to one or more joints, with a scale, an inversion and a deadband
+    around the stick center.
+
+    The table is compiled once: for every axis and every combination of held modifiers it
+    stores the joints to drive, so evaluating an axis is a single lookup. The entries that
+    apply are the most specific ones, an entry is overridden by another one of the same axis
+    whose modifiers include its own, while unrelated entries (i.e. L2 and R1 held) all apply
+    so several joints are driven at the same time.
+    """
+
+    def __init__ (self, buttons, mappings):
+        """
+        Compile the mapping table.
+
+        Parameters
+        ----------
+        buttons : dict
+            The button index by name.
+        mappings : list
+            The entries, dictionaries with the "modifiers" (button names, default none), the
+            "axis" index, the "joints" (or a single "joint"), and optionally the "scale"
+            (default 1.0), "invert" (default False) and "deadband" (default 0.0).
+
+        Raises
+        ------
+        ValueError
+            If an entry refers to an unknown button, or has no valid axis or no joint.
+        """
+        self._buttons = dict(buttons)
+
+        # one bit per button used as a modifier.
+        #
+        modifiers = sorted(set(self._button(name) for mapping in mappings for name in mapping.get("modifiers", ())))
+        self._bits = {button : 1 << i for i, button in enumerate(modifiers)}
+
+        entries = {}
+        for mapping in mappings:
+            joints = mapping.get("joints") or ([mapping["joint"]] if "joint" in mapping else [])
+            if not joints:
+                raise ValueError("mapping without joints: {}".format(mapping))
+            if not isinstance(mapping.get("axis"), int) or (mapping["axis"] < 0):
+                raise ValueError("mapping without a valid axis: {}".format(mapping))
+            mask  = 0
+            for name in mapping.get("modifiers", ()):
+                mask = mask | self._bits[self._button(name)]
+            scale = (float)(mapping.get("scale", 1.0))
+            if mapping.get("invert", False):
+                scale = -scale
+            target = (tuple(joints), scale, (float)(mapping.get("deadband", 0.0)))
+            entries.setdefault(mapping["axis"], []).append((mask, target))
+
+        # the targets of each axis for every modifier mask.
+        #
+        self._table = {}
+        for axis, candidates in entries.items():
+            table = []
+            for held in range(1 << len(modifiers)):
+                matches = [(mask, target) for mask, target in candidates if (mask & held) == mask]
+                table.append(tuple(target for mask, target in matches
+                                   if not any((other != mask) and (other & mask) == mask for other, t in matches)))
+            self._table[axis] = table
+        return
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a mapping table from a JSON file with the "buttons" and the "mappings".
+
+        Parameters
+        ----------
+        path : string
+            The mapping file path.
+
+        Returns
+        -------
+        RobotMapping
+            The compiled mapping table.
+        """
+        with open(path) as f:
+            config = json.load(f)
+        return cls(config["buttons"], config["mappings"])
+
+    def _button(self, name):
+        """
+        Get the index of a button.
+        """
+        if name not in self._buttons:
+            raise ValueError("invalid button: {}".format(name))
+        return self._buttons[name]
+
+    def button(self, name, default=None):
+        """
+        Get the index of a button.
+
+        Parameters
+        ----------
+        name : string
+            The button name.
+        default : int, optional
+            The index returned if the button is not in the table (default is None).
+
+        Returns
+        -------
+        int
+            The button index.
+        """
+        return self._buttons.get(name, default)
+
+    def axes(self):
+        """
+        Get the mapped axes.
+
+        Returns
+        -------
+        list
+            The axis indexes.
+        """
+        return sorted(self._table)
+
+    def bit(self, button):
+        """
+        Get the modifier bit of a button.
+
+        Parameters
+        ----------
+        button : int
+            The button index.
+
+        Returns
+        -------
+        int
+            The bit of the button in the modifier masks, 0 if it is not a modifier.
+        """
+        return self._bits.get(button, 0)
+
+    def mask(self, pressed):
+        """
+        Get the modifier mask of the held buttons.
+
+        Parameters
+        ----------
+        pressed : callable
+            Returns True if the button of a given index is held.
+
+        Returns
+        -------
+        int
+            The modifier mask.
+        """
+        mask = 0
+        for button, bit in self._bits.items():
+            if pressed(button):
+                mask = mask | bit
+        return mask
+
+    def evaluate(self, axis, value, mask):
+        """
+        Get the joint targets of an axis value.
+
+        Parameters
+        ----------
+        axis : int
+            The axis index.
+        value : float
+            The axis value in the range [-1.0, 1.0].
+        mask : int
+            The modifier mask of the held buttons.
+
+        Returns
+        -------
+        list
+            The (joint, position) targets, positions in the range [0.0, 1.0].
+        """
+        table = self._table.get(axis)
+        if table is None:
+            return []
+        targets = []
+        for joints, scale, deadband in table[mask]:
+            v = value if abs(value) >= deadband else 0.0
+            position = min(max(0.5 + 0.5 * scale * v, 0.0), 1.0)
+            for joint in joints:
+                targets.append((joint, position))
+        return targets
+
+    def targets(self, values, mask):
+        """
+        Get the joint targets of several axes sampled in the same frame.
+
+        Parameters
+        ----------
+        values : dict
+            The value of each axis.
+        mask : int
+            The modifier mask of the held buttons.
+
+        Returns
+        -------
+        dict
+            The position of each driven joint.
+        """
+        targets = {}
+        for axis, value in values.items():
+            for joint, position in self.evaluate(axis, value, mask):
+                targets[joint] = position
+        return targets
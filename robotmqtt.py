@@ -1,31 +1,45 @@
 
 import threading
-import time
 import logging
 import paho.mqtt.client as mqtt
 import argparse
+import os
 import sys
+import json
+import math
 
 from robot import Robot
+from robotrouter import RobotRouter
+from robotexecutor import RobotExecutor
+from robotpayload import decode_move, move_key
+from robottrajectory import MAX_STEPS
+from robotchoreography import RobotChoreographyCache, RobotChoreographyLibrary, RobotChoreographyPlayer
+from robottelemetry import RobotTelemetry
+from robotack import ACK_KEYS, ACK_TOPIC, RobotAck, correlation
+from robotlog import setup_logging
 
-def convert_position (position):
+def convert_position (position, quiet=False):
     """
     Convert a string position into its floating point coordinate in the range [0.0, 1.0]
     
     Parameters
     ----------
-        position : string.
-            The new position as strinf. The following string values will be honnored as well:
+        position : string or bytes.
+            The new position as string (MQTT payloads are decoded as UTF-8). The following string values will be honnored as well:
                - "left"  : will be translated to 0.0
                - "right" : will be translated to 1.0
                - "down"  : will be translated to 0.0
                - "up"    : will be translated to 1.0
+        quiet : bool, optional
+            True to not log the invalid positions (default is False).
 
     Returns
     -------
         float
             The floating point coordinate in the range [0.0, 1.0] or -1.0 if the string is not valid or the position is out of range.
     """
+    if isinstance(position, bytes):
+        position = position.decode("utf-8", "replace")
     position = position.replace(",",".")
     if (position == "up"):
         p = 1.0
@@ -38,167 +52,483 @@ def convert_position (position):
     else:
         try:
             p = (float)(position)
-            if ((p < 0.0) or (p > 1.0)):
-                logging.error ("positon out of range: {}".format(position))
+            if not (0.0 <= p <= 1.0):
+                if not quiet:
+                    logging.error ("positon out of range: %s", position)
                 p = -1.0
         except ValueError:
-            logging.error ("invalid float: {}".format(position))
+            if not quiet:
+                logging.error ("invalid float: %s", position)
             p = -1.0
     return p
     
 
-# The callback for when a PUBLISH message is received from the server.
-#
-def on_message(client, robot, msg):
-    
-    logging.debug("topic={} payload={}".format(msg.topic ,msg.payload))
-            
-    if (msg.topic.startswith("robot/body/")):
-        #----------------------------------
-        # operate with the body.
-        #----------------------------------
-        tokens = msg.topic.split('/')
-        if (len(tokens) == 4):
-            part   = tokens[2]
-            action = tokens[3]
-            if (part == "right_arm"):
-                if (action == "move"):
-                    position = convert_position(msg.payload)
-                    if (position >= 0.0):
-                        logging.debug('right arm move: "{}"'.format(position))
-                        robot.body().right_arm_move(position)
-                else:
-                    logging.error('invalid right arm action: "{}"'.format(action))
-            elif (part == "left_arm"):
-                if (action == "move"):
-                    position = convert_position(msg.payload)
-                    if (position >= 0.0):
-                        logging.debug('left arm move: "{}"'.format(position))
-                        robot.body().left_arm_move(position)
-                else:
-                    logging.error('invalid left arm action: "{}"'.format(action))
-            elif (part == "neck"):
-                if (action == "move"):
-                    position = convert_position(msg.payload)
-                    if (position >= 0.0):
-                        logging.debug('left neck move: "{}"'.format(position))
-                        robot.body().neck_move(position)
-                else:
-                    logging.error('invalid neck action: "{}"'.format(action))
-            else:
-                logging.error('invalid body part: "{}"'.format(part))
-        else:
-            logging.error('invalid body command: "{}"'.format(msg.topic))
-            
-
-    elif (msg.topic.startswith("robot/head/")):
-        #----------------------------------
-        # operate with the head.
-        #----------------------------------
-        tokens = msg.topic.split('/')
-        if (len(tokens) == 4):
-            part   = tokens[2]
-            action = tokens[3]
-            if (part == "right_eye"):
-                if (action == "move"):
-                    position = convert_position(msg.payload)
-                    if (position >= 0.0):
-                        logging.debug('right eye move: "{}"'.format(position))
-                        robot.head().right_eye_move(position)
-                else:
-                    logging.error('invalid right arm action: "{}"'.format(action))
-                
-            elif (part == "left_eye"):
-                if (action == "move"):
-                    position = convert_position(msg.payload)
-                    if (position >= 0.0):
-                        logging.debug('left eye move: "{}"'.format(position))
-                        robot.head().left_eye_move(position)
-                else:
-                    logging.error('invalid left arm action: "{}"'.format(action))
-                
-            elif (part == "neck_UD"):
-                if (action == "move"):
-                    position = convert_position(msg.payload)
-                    if (position >= 0.0):
-                        logging.debug('neck UD move: "{}"'.format(position))
-                        robot.head().neck_UD_move(position)
-                else:
-                    logging.error('invalid neck UD action: "{}"'.format(action))
-                    
-            elif (part == "neck_LR"):
-                if (action == "move"):
-                    position = convert_position(msg.payload)
-                    if (position >= 0.0):
-                        logging.debug('neck LR move: "{}"'.format(position))
-                        robot.head().neck_LR_move(position)
-                else:
-                    logging.error('invalid neck LR action: "{}"'.format(action))
-            else:
-                logging.error('invalid head part: "{}"'.format(part))
+def convert_pose (payload, joints):
+    """
+    Convert a JSON pose into the targets of its joints. The pose maps each joint name to its
+    position, or to an object with the position and optionally the speed and steps:
+
+        {"head/neck_LR": 0.5, "body/left_arm": {"position": 1.0, "speed": 0.5, "steps": 20}}
+
+    The correlation keys (see robotack) are ignored.
+
+    Parameters
+    ----------
+        payload : string or bytes.
+            The JSON pose.
+        joints : dict
+            The robot joints by name.
+
+    Returns
+    -------
+        dict
+            The (position, speed, steps) of each joint or None if the pose is not valid, i.e.
+            a non finite speed or more than MAX_STEPS steps.
+    """
+    try:
+        pose = json.loads(payload)
+    except ValueError:
+        logging.error ("invalid pose: %s", payload)
+        return None
+    if not isinstance(pose, dict):
+        logging.error ("invalid pose: %s", payload)
+        return None
+
+    targets = {}
+    for joint, target in pose.items():
+        if joint in ACK_KEYS:
+            continue
+        if joint not in joints:
+            logging.error ("invalid pose joint: %s", joint)
+            return None
+        if not isinstance(target, dict):
+            target = {"position" : target}
+        position = convert_position(str(target.get("position", "")))
+        if (position < 0.0):
+            return None
+        try:
+            speed = (float)(target.get("speed", 0.0))
+            steps = (int)(target.get("steps", 10))
+        except (TypeError, ValueError):
+            logging.error ("invalid pose speed/steps: %s", target)
+            return None
+        if (speed < 0.0) or not math.isfinite(speed) or (steps <= 0) or (steps > MAX_STEPS):
+            logging.error ("invalid pose speed/steps: %s", target)
+            return None
+        targets[joint] = (position, speed, steps)
+    return targets
+
+def joint_position (payload, quiet=False):
+    """
+    Get the position of a joint move payload, the position itself or a JSON object with the
+    position and the correlation keys.
+
+    Parameters
+    ----------
+        payload : string or bytes.
+            The joint move payload.
+        quiet : bool, optional
+            True to not log the invalid positions (default is False).
+
+    Returns
+    -------
+        float
+            The position in the range [0.0, 1.0] or -1.0 if the payload is not valid.
+    """
+    cid, ts = correlation(payload)
+    if cid is None:
+        return convert_position(payload, quiet)
+    return convert_position(str(json.loads(payload).get("position", "")), quiet)
+
+def joint_key (joint):
+    """
+    Get the coalescing key function of the joint moves.
+
+    Parameters
+    ----------
+        joint : string
+            The joint name.
+
+    Returns
+    -------
+        callable
+            The function getting the joint from a move payload, None if the payload is not
+            valid so it never replaces a valid queued move.
+    """
+    def key(payload):
+        return joint if joint_position(payload, True) >= 0.0 else None
+    return key
+
+def on_joint_move(client, msg, joint, servo, ack_topic=ACK_TOPIC):
+    """
+    Move a joint to the position of the message payload. The payload may also be a JSON
+    object with the position and the correlation keys, to get the move acknowledged:
+
+        {"position": 0.5, "id": "ps4-42", "ts": 1700000000.0}
+
+    Parameters
+    ----------
+        client : mqtt.Client
+            The MQTT client.
+        msg : mqtt.MQTTMessage
+            The message, its payload is the position.
+        joint : string
+            The joint name (i.e. "body/right_arm").
+        servo : RobotServo
+            The joint servo.
+        ack_topic : string, optional
+            The topic of the acknowledgements (default is ACK_TOPIC).
+    """
+    cid, ts  = correlation(msg.payload)
+    position = joint_position(msg.payload)
+    if (position >= 0.0):
+        logging.debug('%s move: "%s"', joint, position)
+        if cid is None:
+            servo.move(position)
         else:
-            logging.error('invalid head command: "{}"'.format(msg.topic))
-
-
-    elif (msg.topic == "robot/dance"):
-        #----------------------------------
-        # initialze the robot and terminate.
-        #----------------------------------
-        logging.debug('dance')
-        print("dance")
-        for x in range(0, 6):
-            robot.head().neck_LR_move(0.0)
-            robot.body().right_arm_move(1.0)
-            robot.body().left_arm_move(0.0)
-            time.sleep(0.5)
-            robot.head().neck_LR_move(1.0)
-            robot.body().right_arm_move(0.0)
-            robot.body().left_arm_move(1.0)
-            time.sleep(0.5)
-    elif (msg.topic == "robot/initialize"):
-        #----------------------------------
-        # initialze the robot and terminate.
-        #----------------------------------
-        logging.debug('initialize')
-        robot.initialize ()
-
-    elif (msg.topic == "robot/shutdown"):
-        #----------------------------------
-        # shutdown the robot and terminate.
-        #----------------------------------
-        logging.debug('shutdown')
-        robot.shutdown ()
-
-    elif (msg.topic == "robot/quit"):
-        #----------------------------------
-        # quit.
-        #----------------------------------
-        robot.shutdown ()
-        client.disconnect()
+            ack = RobotAck(client, msg, cid, ts, ack_topic)
+            servo.move(position, on_write=ack.on_write)
+            ack.watch([servo])
+    return
 
+def on_binary_move(client, msg, joints, ack_topic=ACK_TOPIC):
+    """
+    Move a joint from a binary move payload (see robotpayload).
+
+    Parameters
+    ----------
+        client : mqtt.Client
+            The MQTT client.
+        msg : mqtt.MQTTMessage
+            The message, its payload is the binary move.
+        joints : dict
+            The robot joints by name.
+        ack_topic : string, optional
+            The topic of the acknowledgements (default is ACK_TOPIC).
+    """
+    try:
+        move = decode_move(msg.payload)
+    except ValueError as e:
+        logging.error ("invalid binary move: %s", e)
+        return
+    logging.debug('%s move: "%s" seq=%s', move.joint, move.position, move.seq)
+    if move.seq == 0:
+        joints[move.joint].move(move.position, move.speed, move.steps)
     else:
-        logging.error('invalid command: "{}"'.format(msg.topic))
+        # a sequence number requests an acknowledgement.
+        #
+        ack = RobotAck(client, msg, move.seq, None, ack_topic)
+        joints[move.joint].move(move.position, move.speed, move.steps, on_write=ack.on_write)
+        ack.watch([joints[move.joint]])
+    return
+
+def on_pose(client, msg, robot, ack_topic=ACK_TOPIC):
+    """
+    Move several joints within the same control tick.
+
+    Parameters
+    ----------
+        client : mqtt.Client
+            The MQTT client.
+        msg : mqtt.MQTTMessage
+            The message, its payload is the JSON pose.
+        robot : Robot
+            The robot.
+        ack_topic : string, optional
+            The topic of the acknowledgements (default is ACK_TOPIC).
+    """
+    joints  = robot.joints()
+    targets = convert_pose(msg.payload, joints)
+    if targets is not None:
+        logging.debug('pose: "%s"', targets)
+        cid, ts = correlation(msg.payload)
+        if cid is None:
+            robot.pose(targets)
+        else:
+            ack = RobotAck(client, msg, cid, ts, ack_topic)
+            robot.pose(targets, ack.on_write)
+            ack.watch([joints[joint] for joint in targets])
+    return
+
+def on_dance(client, msg, player, choreography):
+    """
+    Start playing a choreography.
+
+    Parameters
+    ----------
+        client : mqtt.Client
+            The MQTT client.
+        msg : mqtt.MQTTMessage
+            The message.
+        player : RobotChoreographyPlayer
+            The choreography player.
+        choreography : RobotChoreography
+            The choreography to play.
+    """
+    logging.debug('dance: %s', choreography.name())
+    player.start(choreography)
+    return
+
+def on_dance_stop(client, msg, player):
+    """
+    Stop playing the current choreography.
+    """
+    logging.debug('dance stop')
+    player.stop()
+    return
+
+def on_initialize(client, msg, robot):
+    """
+    Initialize the robot.
+    """
+    logging.debug('initialize')
+    robot.initialize ()
+    return
+
+def on_shutdown(client, msg, robot, player):
+    """
+    Shutdown the robot.
+    """
+    logging.debug('shutdown')
+    player.stop()
+    robot.shutdown ()
+    return
+
+def on_quit(client, msg, robot, player):
+    """
+    Shutdown the robot and terminate.
+    """
+    player.stop()
+    robot.shutdown ()
+    logging.info('bus statistics: %s', robot.board().statistics())
+    client.disconnect()
+    return
+
+
+class RobotMQTT:
+    """
+    This class implements the robot MQTT interface. The messages are routed by topic and
+    their commands are run by the executor lanes, off the MQTT network thread.
+    """
+
+    def __init__ (self, robot, library=None, executor=None, prefix="robot/", router=None):
+        """
+        Initialize the MQTT interface, building the topic router from the robot joints and
+        the choreographies.
+
+        Parameters
+        ----------
+        robot : Robot
+            The robot to operate.
+        library : RobotChoreographyLibrary, optional
+            The choreographies that can be played, None (default) for none.
+        executor : RobotExecutor, optional
+            The executor running the commands, None (default) for one with the default lanes.
+        prefix : string, optional
+            The topic prefix of the robot commands (default is "robot/").
+        router : RobotRouter, optional
+            The router to register the robot topics in, shared by several robots, None
+            (default) for a router of its own. Only a robot with its own router handles
+            the quit command, that terminates the whole interface.
+        """
+        self._robot   = robot
+        self._prefix  = prefix
+        self._router  = router or RobotRouter()
+        self._player  = RobotChoreographyPlayer(robot)
+
+        # the acknowledgements are published per robot, as the commands and the state.
+        #
+        ack_topic = prefix + "ack"
+        for joint, servo in robot.joints().items():
+            self._router.add(prefix + "{}/move".format(joint), on_joint_move, joint, servo, ack_topic, coalesce=prefixed_key(prefix, joint_key(joint)))
+
+        self._router.add(prefix + "move/bin",   on_binary_move, robot.joints(), ack_topic, coalesce=prefixed_key(prefix, move_key))
+        self._router.add(prefix + "pose",       on_pose,       robot, ack_topic)
+        # the choreographies are played by name, "dance" being the default one.
+        #
+        if library is not None:
+            for name in library.names():
+                self._router.add(prefix + "dance/" + name, on_dance, self._player, library.get(name), lane="choreography")
+            if "dance" in library.names():
+                self._router.add(prefix + "dance", on_dance, self._player, library.get("dance"), lane="choreography")
+        self._router.add(prefix + "dance/stop", on_dance_stop, self._player, lane="choreography")
+
+        self._router.add(prefix + "initialize", on_initialize, robot, lane="choreography")
+        self._router.add(prefix + "shutdown",   on_shutdown,   robot, self._player, lane="choreography")
+        if router is None:
+            self._router.add(prefix + "quit",   on_quit,       robot, self._player, lane="choreography")
+
+        # the topics published by the robot itself.
+        #
+        self._router.ignore(prefix + "state")
+        self._router.ignore(ack_topic)
+
+        self._executor = executor or RobotExecutor()
+        return
+
+    def prefix(self):
+        """
+        Get the topic prefix of the robot commands.
+
+        Returns
+        -------
+        string
+            The topic prefix.
+        """
+        return self._prefix
+
+    def robot(self):
+        """
+        Get the robot.
+
+        Returns
+        -------
+        Robot
+            The robot operated by the interface.
+        """
+        return self._robot
+
+    def router(self):
+        """
+        Get the topic router.
+
+        Returns
+        -------
+        RobotRouter
+            The topic router.
+        """
+        return self._router
+
+    def player(self):
+        """
+        Get the choreography player.
+
+        Returns
+        -------
+        RobotChoreographyPlayer
+            The choreography player.
+        """
+        return self._player
+
+    def executor(self):
+        """
+        Get the command executor.
+
+        Returns
+        -------
+        RobotExecutor
+            The command executor.
+        """
+        return self._executor
+
+    def shutdown(self):
+        """
+        Stop the command executor once the queued commands have been executed.
+        """
+        self._executor.shutdown()
+        logging.info('executor statistics: %s', self._executor.statistics())
+        return
+
+    def on_message(self, client, msg):
+        """
+        Handle a message received from the broker, enqueueing its command in the executor
+        lane of its topic. The joint moves are coalesced by joint: a new target replaces the
+        one of the same joint that is still waiting to be executed.
+
+        Parameters
+        ----------
+        client : mqtt.Client
+            The MQTT client.
+        msg : mqtt.MQTTMessage
+            The received message.
+        """
+        dispatch(self._router, self._executor, client, msg)
+        return
+
+
+def dispatch(router, executor, client, msg):
+    """
+    Enqueue the command of a message in the executor lane of its topic, coalescing it with
+    the queued command of the same key.
+
+    Parameters
+    ----------
+        router : RobotRouter
+            The topic router.
+        executor : RobotExecutor
+            The command executor.
+        client : mqtt.Client
+            The MQTT client.
+        msg : mqtt.MQTTMessage
+            The received message.
+    """
+    logging.debug("topic=%s payload=%s", msg.topic ,msg.payload)
+    route = router.lookup(msg.topic)
+    if route is None:
+        if not router.ignored(msg.topic):
+            logging.error('invalid command: "%s"', msg.topic)
+        return
+    handler, args, lane, coalesce = route
+    key = coalesce(msg.payload) if callable(coalesce) else coalesce
+    executor.submit(lane, handler, client, msg, *args, key=key)
+    return
+
+def prefixed_key(prefix, coalesce):
+    """
+    Prefix the coalescing keys got from the payloads, so the robots sharing an executor never
+    coalesce each other commands. The text and binary moves of a joint get the same key.
+
+    Parameters
+    ----------
+        prefix : string
+            The robot topic prefix.
+        coalesce : callable
+            The function getting the coalescing key from a payload.
+
+    Returns
+    -------
+        callable
+            The function getting the prefixed key, None keys are not prefixed.
+    """
+    def key(payload):
+        k = coalesce(payload)
+        return prefix + k if k is not None else None
+    return key
+
+# The callback for when a PUBLISH message is received from the server.
+#
+def on_message(client, robotmqtt, msg):
+    robotmqtt.on_message(client, msg)
 
 if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description='Robot MQTT Interface.')
     parser.add_argument('-d', '--debug', action="store_true", dest="debug", default=False, help="enable debug mode")
+    parser.add_argument('-b', '--blocking', action="store_true", dest="blocking", default=False, help="wait for the current move instead of retargeting it")
+    parser.add_argument('-s', '--simulate', action="store_true", dest="simulate", default=False, help="use the simulated servo board")
+    parser.add_argument('-r', '--rate', type=float, dest="rate", default=100.0, help="motion scheduler rate in Hz")
+    parser.add_argument('-t', '--telemetry', type=float, dest="telemetry", default=10.0, help="robot/state telemetry rate in Hz, 0 to disable")
+    parser.add_argument('-c', '--choreographies', dest="choreographies", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "choreographies"), help="choreographies directory")
     args = parser.parse_args()
 
     format = "%(asctime)s: %(message)s"
     if args.debug:
-        logging.basicConfig(format=format, level=logging.DEBUG, datefmt="%H:%M:%S")
+        setup_logging(logging.DEBUG, format)
     else:
-        logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+        setup_logging(logging.INFO, format)
     
     # create the robot.
     #
-    robot = Robot("walle")
+    robot = Robot("walle", args.rate, "simulated" if args.simulate else "pca9685")
+    robot.set_retarget(not args.blocking)
     robot.initialize()
     
     # create the MQTT client.
     #
-    client = mqtt.Client(robot.name(), True, robot)
+    cache     = RobotChoreographyCache(os.path.join(args.choreographies, ".cache"))
+    library   = RobotChoreographyLibrary(args.choreographies, args.rate, cache)
+    robotmqtt = RobotMQTT(robot, library)
+    client    = mqtt.Client(robot.name(), True, robotmqtt)
 
     # connect to the broker.
     #
@@ -209,10 +539,18 @@ if __name__ == "__main__":
     client.on_message    = on_message
     client.subscribe("robot/#")
 
+    # publish the robot state.
+    #
+    telemetry = RobotTelemetry(robot, client, args.telemetry) if args.telemetry > 0.0 else None
+    if telemetry is not None:
+        telemetry.start()
+
     # Blocking call that processes network traffic, dispatches callbacks and handles reconnecting.
     #
-    shutdown = False
     client.loop_forever()
+    if telemetry is not None:
+        telemetry.stop()
+    robotmqtt.shutdown()
     
     
 
@@ -0,0 +1,157 @@
+import math
+import struct
+
+from robottrajectory import MAX_STEPS
+
+# Binary payload format version.
+#
+VERSION = 1
+
+# Joint identifiers of the binary payloads.
+#
+JOINTS = ("head/left_eye", "head/right_eye", "head/neck_UD", "head/neck_LR",
+          "body/neck", "body/left_arm", "body/right_arm")
+
+# Payload flags.
+#
+FLAG_FLOAT = 0x01
+FLAG_SPEED = 0x02
+
+# Precompiled payload layouts by flags, all little-endian: version, flags, joint id, padding
+# and sequence number, followed by the position (uint16 scaled to [0.0, 1.0] or float32)
+# and optionally the speed (float32) and steps (uint16). A non-zero sequence number requests
+# an acknowledgement of the move (see robotack).
+#
+_LAYOUTS = {
+    0                        : struct.Struct("<BBBxIH"),
+    FLAG_FLOAT               : struct.Struct("<BBBxIf"),
+    FLAG_SPEED               : struct.Struct("<BBBxIHfH"),
+    FLAG_FLOAT | FLAG_SPEED  : struct.Struct("<BBBxIffH"),
+}
+
+_SCALE = 65535.0
+
+class RobotMove:
+    """
+    This class implements a decoded binary move command.
+    """
+
+    __slots__ = ("joint", "position", "speed", "steps", "seq")
+
+    def __init__ (self, joint, position, speed=0.0, steps=10, seq=0):
+        """
+        Initialize the move command.
+
+        Parameters
+        ----------
+        joint : string
+            The joint name.
+        position : float
+            The target position in the range [0.0, 1.0].
+        speed : float, optional
+            The move speed, 0.0 (default) for a direct move.
+        steps : int, optional
+            The number of steps (default is 10).
+        seq : int, optional
+            The sequence number (default is 0).
+        """
+        self.joint    = joint
+        self.position = position
+        self.speed    = speed
+        self.steps    = steps
+        self.seq      = seq
+        return
+
+
+def encode_move(joint, position, speed=0.0, steps=10, seq=0, precise=False):
+    """
+    Encode a move command as a binary payload.
+
+    Parameters
+    ----------
+    joint : string
+        The joint name, one of JOINTS.
+    position : float
+        The target position in the range [0.0, 1.0].
+    speed : float, optional
+        The move speed, 0.0 (default) for a direct move.
+    steps : int, optional
+        The number of steps (default is 10).
+    seq : int, optional
+        The sequence number (default is 0).
+    precise : bool, optional
+        True to encode the position as float32 instead of uint16 (default is False).
+
+    Returns
+    -------
+    bytes
+        The binary payload.
+    """
+    flags = (FLAG_FLOAT if precise else 0) | (FLAG_SPEED if speed > 0.0 else 0)
+    value = position if precise else int(round(min(max(position, 0.0), 1.0) * _SCALE))
+    fields = [VERSION, flags, JOINTS.index(joint), seq & 0xFFFFFFFF, value]
+    if speed > 0.0:
+        fields.extend((speed, steps))
+    return _LAYOUTS[flags].pack(*fields)
+
+def decode_move(payload):
+    """
+    Decode a binary move command.
+
+    Parameters
+    ----------
+    payload : bytes
+        The binary payload.
+
+    Returns
+    -------
+    RobotMove
+        The move command.
+
+    Raises
+    ------
+    ValueError
+        If the payload is not a valid move command.
+    """
+    if len(payload) < 2:
+        raise ValueError("truncated payload")
+    layout = _LAYOUTS.get(payload[1])
+    if (layout is None) or (len(payload) != layout.size):
+        raise ValueError("invalid payload layout")
+
+    fields = layout.unpack(payload)
+    version, flags, joint, seq, value = fields[:5]
+    if version != VERSION:
+        raise ValueError("unsupported payload version: {}".format(version))
+    if joint >= len(JOINTS):
+        raise ValueError("invalid joint id: {}".format(joint))
+
+    position = value if flags & FLAG_FLOAT else value / _SCALE
+    if not (0.0 <= position <= 1.0):
+        raise ValueError("position out of range: {}".format(position))
+    if flags & FLAG_SPEED:
+        speed, steps = fields[5:]
+        if not (speed >= 0.0) or not math.isfinite(speed) or (steps == 0) or (steps > MAX_STEPS):
+            raise ValueError("invalid speed/steps: {}/{}".format(speed, steps))
+        return RobotMove(JOINTS[joint], position, speed, steps, seq)
+    return RobotMove(JOINTS[joint], position, seq=seq)
+
+def move_key(payload):
+    """
+    Get the joint of a binary payload, used to coalesce the moves. Only the valid payloads
+    get a key, so an invalid one never replaces a valid queued move.
+
+    Parameters
+    ----------
+    payload : bytes
+        The binary payload.
+
+    Returns
+    -------
+    string
+        The joint name, None if the payload is not a valid move command.
+    """
+    try:
+        return decode_move(payload).joint
+    except ValueError:
+        return None
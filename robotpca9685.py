@@ -0,0 +1,80 @@
+from SunFounder_PCA9685 import PCA9685
+
+from robotbackend import RobotServoBackend
+
+class RobotPCA9685(RobotServoBackend):
+    """
+    This class implements the PCA9685 servo board backend. The channel updates are flushed
+    once per scheduler tick using auto-increment block writes.
+    """
+
+    _MODE1           = 0x00
+    _AI              = 0x20
+    _LED0_ON_L       = 0x06
+    _MIN_PULSE_WIDTH = 600
+    _MAX_PULSE_WIDTH = 2400
+    _FREQUENCY       = 60
+
+    def __init__ (self, globalLock, bus_number=None, address=0x40):
+        """
+        Initialize the servo board.
+
+        Parameters
+        ----------
+        globalLock :
+            The global thread lock to be used when writing to the bus.
+        bus_number : int, optional
+            The I2C bus number, None (default) to autodetect it.
+        address : int, optional
+            The I2C address of the board (default is 0x40).
+
+        """
+        RobotServoBackend.__init__(self, globalLock)
+        self._pwm     = PCA9685.PWM(bus_number=bus_number, address=address)
+        self._address = address
+        return
+
+    def _setup(self):
+        """
+        Setup the board, enabling the register auto-increment.
+        """
+        self._pwm.setup()
+        self._pwm.frequency = self._FREQUENCY
+        mode1 = self._pwm.bus.read_byte_data(self._address, self._MODE1)
+        self._pwm.bus.write_byte_data(self._address, self._MODE1, mode1 | self._AI)
+        return
+
+    def _send(self, blocks):
+        """
+        Send each block of consecutive channels with a single block write.
+
+        Parameters
+        ----------
+        blocks : list
+            A list of (first channel, angles) tuples.
+        """
+        for first, angles in blocks:
+            data = []
+            for angle in angles:
+                value = self._angle_to_analog(angle)
+                data.extend((0, 0, value & 0xFF, value >> 8))
+            self._pwm.bus.write_i2c_block_data(self._address, self._LED0_ON_L + 4 * first, data)
+        return
+
+    def _angle_to_analog(self, angle):
+        """
+        Converts a servo angle to its PWM off count.
+
+        Parameters
+        ----------
+        angle : int
+            The servo angle in degrees, clamped to [0, 180].
+
+        Returns
+        -------
+        int
+            The PWM off count for the angle.
+        """
+        angle = min(max(angle, 0), 180)
+        pulse = angle * (self._MAX_PULSE_WIDTH - self._MIN_PULSE_WIDTH) / 180.0 + self._MIN_PULSE_WIDTH
+        return (int)(pulse / 1000000.0 * self._FREQUENCY * 4096)
@@ -2,16 +2,26 @@
 import os
 import pprint
 import pygame
-import paho.mqtt.publish as publish
 import sys
 import logging
 import time
+import json
+import numpy
+import collections
 import argparse
 
+from robotlog import setup_logging
+from robotpublisher import RobotPublisher
+from robotmapping import RobotMapping
+from robotrecorder import RobotRecorder
+
 class RobotPS4Controller(object):
     """Class representing the Robot controller."""
 
     controller      = None
+    publisher       = None
+    mapping         = None
+    latencies       = None
     axis_data       = None
     button_data     = None
     hat_data        = None
@@ -30,28 +40,131 @@ class RobotPS4Controller(object):
     HAT_RIGHT = (1,0)
     HAT_LEFT =(-1,0)
     
-    def init(self):
-        """Initialize the joystick components"""
+    def init(self, publisher, mapping):
+        """Initialize the joystick components, the persistent robot connection and the
+        controller mapping table"""
         
+        self.publisher = publisher
+        self.mapping   = mapping
+
+        # the action buttons are named in the mapping table as well.
+        #
+        self.CROSS_BUTTON   = mapping.button("cross",   self.CROSS_BUTTON)
+        self.SHARE_BUTTON   = mapping.button("share",   self.SHARE_BUTTON)
+        self.OPTIONS_BUTTON = mapping.button("options", self.OPTIONS_BUTTON)
+        self.latencies = collections.deque(maxlen=1000)
         pygame.init()
 
-        # initialize the joysitck and wait for one connected.
+        # only wakeup for the controller events.
+        #
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed([pygame.JOYAXISMOTION, pygame.JOYBUTTONDOWN, pygame.JOYBUTTONUP,
+                                  pygame.JOYHATMOTION, pygame.JOYDEVICEADDED, pygame.JOYDEVICEREMOVED])
+
+        # initialize the joysitck and wait for one connected, sleeping until it is plugged in.
         #
         pygame.joystick.init()
         if (pygame.joystick.get_count() == 0):
-            joyready = False
-            while (not joyready):
-                pygame.joystick.quit()
-                time.sleep (1.0)
-                pygame.joystick.init()
-                joyready = (pygame.joystick.get_count() != 0)
+            logging.info("waiting for a joystick...")
+        while (pygame.joystick.get_count() == 0):
+            pygame.event.wait(1000)
             
         self.controller = pygame.joystick.Joystick(0)
         self.controller.init()
 
-    def value2pos (self, value):
-        position = (value + 1.0) / 2.0
-        return min(max(position, 0.0),1.0)
+    def wait_events (self, timeout=0.5):
+        """Block until there are events or the timeout in seconds expires, returns the pending events"""
+
+        event = pygame.event.wait(int(timeout * 1000))
+        if event.type == pygame.NOEVENT:
+            return []
+        return [event] + pygame.event.get()
+
+    def send (self, topic, payload, received):
+        """Publish a command, measuring the latency since the event that triggered it was received"""
+
+        self.publisher.publish (topic, payload)
+        self.latencies.append(time.monotonic() - received)
+
+    def statistics (self):
+        """Get the event-to-publish latency (p50, p99 and maximum in seconds) of the latest commands"""
+
+        if not self.latencies:
+            return {}
+        p50, p99, pmax = numpy.percentile(numpy.array(self.latencies), (50, 99, 100)).tolist()
+        return {"commands" : len(self.latencies), "p50" : p50, "p99" : p99, "max" : pmax}
+
+    def dance_step (self, state, value):
+        """Advance the up-down-up-down hat sequence that starts the dance, returns the new state"""
+
+        if state == 0:
+            if value == self.HAT_UP:
+                state = 1
+        elif state == 1:
+            state = 2 if value == self.HAT_DOWN else 0
+        elif state == 2:
+            state = 3 if value == self.HAT_UP else 0
+        elif state == 3:
+            if value == self.HAT_DOWN:
+                self.publisher.publish ("robot/dance", str(0.0))
+            state = 0
+        return state
+
+    def frame_targets (self):
+        """Sample the sticks and the held buttons, returns the target of each driven joint"""
+
+        mask   = self.mapping.mask(self.controller.get_button)
+        values = {axis : self.controller.get_axis(axis) for axis in self.mapping.axes()}
+        return self.mapping.targets(values, mask)
+
+    def listen_frames (self, rate=50.0, deadband=0.02):
+        """Sample the controller at a fixed rate and send at most one pose per frame, with the
+        joints that moved more than the deadband since their last update"""
+
+        sent     = {}
+        state    = 0
+        frames   = 0
+        poses    = 0
+        quit     = False
+        period   = 1.0 / rate
+        deadline = time.monotonic()
+        wall     = time.monotonic()
+        cpu      = time.process_time()
+        while not quit:
+            received = time.monotonic()
+
+            # the buttons released and the hat are discrete events, handle them as such.
+            #
+            for event in pygame.event.get():
+                if event.type == pygame.JOYBUTTONUP:
+                    if event.button == self.CROSS_BUTTON:
+                        self.publisher.publish ("robot/quit", "", qos=2, wait=5.0)
+                        quit = True
+                    elif event.button == self.SHARE_BUTTON:
+                        quit = True
+                elif event.type == pygame.JOYHATMOTION:
+                    if (event.hat == 0) and self.controller.get_button(self.OPTIONS_BUTTON) and (event.value != (0,0)):
+                        state = self.dance_step(state, event.value)
+
+            # send the joints that changed, all of them in the same pose.
+            #
+            pose = {}
+            for joint, position in self.frame_targets().items():
+                if abs(position - sent.get(joint, -1.0)) >= deadband:
+                    pose[joint]  = round(position, 3)
+                    sent[joint]  = position
+            if pose and not quit:
+                logging.debug("pose: %s", pose)
+                self.send ("robot/pose", json.dumps(pose, separators=(",", ":")), received)
+                poses = poses + 1
+            frames = frames + 1
+
+            now      = time.monotonic()
+            deadline = max(deadline + period, now)
+            time.sleep(max(deadline - now, 0.0))
+        wall = time.monotonic() - wall
+        cpu  = time.process_time() - cpu
+        logging.info("frames=%s poses=%s cpu=%.1f%% latency=%s", frames, poses, 100.0 * cpu / wall, self.statistics())
         
     def listen(self):
         """Listen for events to happen"""
@@ -69,186 +182,82 @@ class RobotPS4Controller(object):
             for i in range(self.controller.get_numhats()):
                 self.hat_data[i] = (0, 0)
 
-        quit        = False
-        left_arm    = False
-        left_arm_p  = -1.0
-        right_arm   = False
-        right_arm_p = -1.0
-        neckLR      = False
-        neckLR_p    = -1.0
-        left_eye    = False
-        left_eye_p  = -1.0
-        right_eye   = False
-        right_eye_p = -1.0
-        neck_Body_UD = False
-        neck_Body_UD_p = -1
-        neck_UD = False
-        neck_UD_p = -1
+        quit    = False
+        sent    = {}
+        mask    = 0
         actions = False
         state   = 0
         
+        wall = time.monotonic()
+        cpu  = time.process_time()
         while not quit:
-            for event in pygame.event.get():
+            events   = self.wait_events()
+            received = time.monotonic()
+            for event in events:
                 if event.type == pygame.JOYAXISMOTION:
-                    if event.axis == 0:
-                        if neckLR:
-                            # moving the neck left-right.
-                            #
-                            position = self.value2pos(event.value)
-                            logging.debug("neckLR: {} {}".format(position, neckLR_p))
-                            if position != neckLR_p:
-                                publish.single ("robot/head/neck_LR/move", payload=str(position) , hostname='localhost')
-                                neckLR_p = position
-                            
-                    if event.axis == 1:
-                        if left_arm==True and right_arm==True:
-                            # moving the left and right arm up-down.
-                            #
-                            position = 1.0 - self.value2pos(event.value)
-                            logging.debug("left_arm: {} {}".format(position, left_arm_p))
-                            if position != left_arm_p:
-                                publish.single ("robot/body/left_arm/move", payload=str(position) , hostname='localhost')
-                            logging.debug("right_arm: {} {}".format(position, right_arm_p))
-                            if position != right_arm_p:
-                                publish.single ("robot/body/right_arm/move", payload=str(position) , hostname='localhost')
-                                
-                        elif left_eye==True and right_eye==True:
-                            # moving the left and right arm up-down.
-                            #
-                            position = 1.0 - self.value2pos(event.value)
-                            logging.debug("left_arm: {} {}".format(position, left_eye_p))
-                            if position != left_eye_p:
-                                publish.single ("robot/head/left_eye/move", payload=str(position) , hostname='localhost')
-                            logging.debug("right_eye: {} {}".format(position, right_eye_p))
-                            if position != right_eye_p:
-                                publish.single ("robot/head/right_eye/move", payload=str(position) , hostname='localhost')
-                        elif left_arm:
-                            # moving the left arm up-down.
-                            #
-                            position = 1.0 - self.value2pos(event.value)
-                            logging.debug("left_arm: {} {}".format(position, left_arm_p))
-                            if position != left_arm_p:
-                                publish.single ("robot/body/left_arm/move", payload=str(position) , hostname='localhost')
-
-                        elif right_arm:
-                            # moving the right arm up-down.
-                            #
-                            position = 1.0 - self.value2pos(event.value)
-                            logging.debug("right_arm: {} {}".format(position, right_arm_p))
-                            if position != right_arm_p:
-                                publish.single ("robot/body/right_arm/move", payload=str(position) , hostname='localhost')
-                                
-                        elif left_eye:
-                            # moving the left arm up-down.
-                            #
-                            position = 1.0 - self.value2pos(event.value)
-                            logging.debug("left_eye: {} {}".format(position, left_eye_p))
-                            if position != left_eye_p:
-                                publish.single ("robot/head/left_eye/move", payload=str(position) , hostname='localhost')
-                                
-                        elif right_eye:
-                            # moving the left arm up-down.
-                            #
-                            position = 1.0 - self.value2pos(event.value)
-                            logging.debug("right_eye: {} {}".format(position, right_eye_p))
-                            if position != right_eye_p:
-                                publish.single ("robot/head/right_eye/move", payload=str(position) , hostname='localhost')
-                        elif neck_UD:
-                            # moving the left arm up-down.
-                            #
-                            position = 1.0 - self.value2pos(event.value)
-                            logging.debug("neck_UD: {} {}".format(position, neck_UD_p))
-                            if position != neck_UD_p:
-                                publish.single ("robot/head/neck_UD/move", payload=str(position) , hostname='localhost')
-                        elif neck_Body_UD:
-                            # moving the left arm up-down.
-                            #
-                            position = 1.0 - self.value2pos(event.value)
-                            logging.debug("neck_UD: {} {}".format(position, neck_Body_UD_p))
-                            if position != neck_Body_UD_p:
-                                publish.single ("robot/body/neck/move", payload=str(position) , hostname='localhost')
-                                
-
+                    # moving every joint mapped to the axis with the held modifiers.
+                    #
+                    for joint, position in self.mapping.evaluate(event.axis, event.value, mask):
+                        logging.debug("%s: %s %s", joint, position, sent.get(joint))
+                        if position != sent.get(joint):
+                            self.send ("robot/{}/move".format(joint), str(position), received)
+                            sent[joint] = position
                                 
                 elif event.type == pygame.JOYBUTTONDOWN:
-                    logging.debug("down {} button".format(event.button))
-                    if event.button == self.L2_BUTTON:
-                        left_arm = True
-                    elif event.button == self.R2_BUTTON:
-                        right_arm = True
-                    elif event.button == self.CIRCLE_BUTTON:
-                        neckLR = True
-                    elif event.button == self.R1_BUTTON:
-                        right_eye = True
-                    elif event.button == self.L1_BUTTON:
-                        left_eye = True
-                    elif event.button == self.TRIANGLE_BUTTON:
-                        neck_Body_UD = True
-                    elif event.button == self.SQUARE_BUTTON:
-                        neck_UD = True
-                    elif event.button == self.OPTIONS_BUTTON:
+                    logging.debug("down %s button", event.button)
+                    mask = mask | self.mapping.bit(event.button)
+                    if event.button == self.OPTIONS_BUTTON:
                         actions = True
                         
                 elif event.type == pygame.JOYBUTTONUP:
-                    logging.debug("up {} button".format(event.button))
+                    logging.debug("up %s button", event.button)
+                    mask = mask & ~self.mapping.bit(event.button)
                     if event.button == self.CROSS_BUTTON:
-                        publish.single ("robot/quit", payload="" , hostname='localhost', qos=2)
+                        self.publisher.publish ("robot/quit", "", qos=2, wait=5.0)
                         quit = True
                     elif event.button == self.SHARE_BUTTON:
                         quit = True
-                    elif event.button == self.L2_BUTTON:
-                        left_arm = False
-                    elif event.button == self.R2_BUTTON:
-                        right_arm = False
-                    elif event.button == self.CIRCLE_BUTTON:
-                        neckLR = False
-                    elif event.button == self.TRIANGLE_BUTTON:
-                        neck_Body_UD = False
-                    elif event.button == self.SQUARE_BUTTON:
-                        neck_UD = False
-                    elif event.button == self.R1_BUTTON:
-                        right_eye = False
-                    elif event.button == self.L1_BUTTON:
-                        left_eye = False
                     elif event.button == self.OPTIONS_BUTTON:
                         actions = False
                         
                 elif event.type == pygame.JOYHATMOTION:
                     if event.hat == 0:
-                        logging.debug("HAT button {} actions={} state={}".format(event.value, actions, state))
+                        logging.debug("HAT button %s actions=%s state=%s", event.value, actions, state)
                         if (actions == True) and (event.value != (0,0)):
-                            if state == 0:
-                                if event.value == (0,1):
-                                    state = 1
-                            elif state == 1:
-                                if event.value == (0,-1):
-                                    state = 2
-                                else:
-                                    state = 0
-                            elif state == 2:
-                                if event.value == (0,1):
-                                    state = 3
-                                else:
-                                    state = 0
-                            elif state == 3:
-                                if event.value == (0,-1):
-                                    publish.single ("robot/dance", payload=str(0.0) , hostname='localhost')
-                                state = 0
-
-                                    
+                            state = self.dance_step(state, event.value)
+
+        wall = time.monotonic() - wall
+        cpu  = time.process_time() - cpu
+        logging.info("cpu=%.1f%% latency=%s", 100.0 * cpu / wall, self.statistics())
+
+
 if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description='Robot Joystick Interface.')
     parser.add_argument('-d', '--debug', action="store_true", dest="debug", default=False, help="enable debug mode")
+    parser.add_argument('-f', '--frame-rate', type=float, dest="frame_rate", default=0.0, help="sample the controller at this rate in Hz and send one pose per frame, 0 to send every axis event")
+    parser.add_argument('-b', '--deadband', type=float, dest="deadband", default=0.02, help="minimum joint change sent in frame mode")
+    parser.add_argument('-m', '--mapping', dest="mapping", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "ps4mapping.json"), help="controller mapping table")
+    parser.add_argument('-o', '--record', dest="record", default=None, help="append the commands sent to this recording file")
+    parser.add_argument('-H', '--host', dest="host", default="localhost", help="broker host")
+    parser.add_argument('-p', '--port', type=int, dest="port", default=1883, help="broker port")
     args = parser.parse_args()
 
     format = "%(asctime)s: %(message)s"
     if args.debug:
-        logging.basicConfig(format=format, level=logging.DEBUG, datefmt="%H:%M:%S")
+        setup_logging(logging.DEBUG, format)
     else:
-        logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+        setup_logging(logging.INFO, format)
     
 
-    robotps4 = RobotPS4Controller()
-    robotps4.init()
-    robotps4.listen()
+    publisher = RobotPublisher(args.host, args.port)
+    recorder  = RobotRecorder(args.record, publisher) if args.record else None
+    robotps4  = RobotPS4Controller()
+    robotps4.init(recorder or publisher, RobotMapping.load(args.mapping))
+    if args.frame_rate > 0.0:
+        robotps4.listen_frames(args.frame_rate, args.deadband)
+    else:
+        robotps4.listen()
+    if recorder is not None:
+        recorder.close()
+    publisher.shutdown()
@@ -0,0 +1,177 @@
+import time
+import logging
+import threading
+import collections
+import numpy as np
+import paho.mqtt.client as mqtt
+
+class RobotPublisher:
+    """
+    This class implements a persistent MQTT publisher: a single long-lived connection served
+    by the paho background network thread, reconnecting automatically, instead of one
+    connection per message. It measures the publish latency (from the publish call until the
+    message is sent, or acknowledged for QoS > 0) and how much the connection is reused.
+    """
+
+    def __init__ (self, host="localhost", port=1883, keepalive=60, client_id="", window=1000):
+        """
+        Start connecting to the broker in the background.
+
+        Parameters
+        ----------
+        host : string, optional
+            The broker host (default is "localhost").
+        port : int, optional
+            The broker port (default is 1883).
+        keepalive : int, optional
+            The keepalive period in seconds (default is 60).
+        client_id : string, optional
+            The client identifier, "" (default) for a random one.
+        window : int, optional
+            The number of latest publish latencies kept for the statistics (default is 1000).
+        """
+        self._lock        = threading.Lock()
+        self._connected   = threading.Event()
+        self._pending     = {}
+        self._early       = {}
+        self._latencies   = collections.deque(maxlen=window)
+        self._published   = 0
+        self._dropped     = 0
+        self._connections = 0
+        self._client      = mqtt.Client(client_id)
+        self._client.on_connect    = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+        self._client.on_publish    = self._on_publish
+        self._client.reconnect_delay_set(0.5, 5.0)
+        self._client.connect_async(host, port, keepalive)
+        self._client.loop_start()
+        return
+
+    def wait_connected(self, timeout=None):
+        """
+        Wait until the client is connected.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The maximum time to wait in seconds, None (default) to wait forever.
+
+        Returns
+        -------
+        bool
+            True if the client is connected.
+        """
+        return self._connected.wait(timeout)
+
+    def publish(self, topic, payload=None, qos=0, wait=None):
+        """
+        Publish a message on the persistent connection. The QoS 0 messages published while
+        the connection is down are dropped, they are stale by the time it is back.
+
+        Parameters
+        ----------
+        topic : string
+            The message topic.
+        payload : string or bytes, optional
+            The message payload (default is None).
+        qos : int, optional
+            The quality of service (default is 0).
+        wait : float, optional
+            The maximum time in seconds to wait until the message has been sent, None
+            (default) to return right away.
+
+        Returns
+        -------
+        bool
+            True if the message has been handed over to the client, False if it has been
+            dropped or, for QoS > 0, queued because the connection is down.
+        """
+        # paho calls on_publish holding its own lock, so publish without holding ours.
+        #
+        start = time.monotonic()
+        info  = self._client.publish(topic, payload, qos)
+        self._lock.acquire()
+        if info.rc != mqtt.MQTT_ERR_SUCCESS and qos == 0:
+            self._dropped = self._dropped + 1
+            self._lock.release()
+            logging.debug("publish(%s): dropped, rc=%s", topic, info.rc)
+            return False
+        sent = self._early.pop(info.mid, None)
+        if sent is not None:
+            # already sent (or acknowledged) by the network thread.
+            #
+            self._latencies.append(sent - start)
+        else:
+            self._pending[info.mid] = start
+        self._published = self._published + 1
+        self._lock.release()
+
+        # the QoS > 0 messages are queued while disconnected, there is nothing to wait for.
+        #
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            logging.warning("publish(%s): not sent, rc=%s", topic, info.rc)
+            return False
+        if wait is not None:
+            info.wait_for_publish(wait)
+        return True
+
+    def statistics(self):
+        """
+        Get the publisher statistics.
+
+        Returns
+        -------
+        dict
+            The number of messages published and dropped, the number of connections made and
+            the messages per connection, and the p50, p99 and maximum publish latency of the
+            latest messages in seconds.
+        """
+        self._lock.acquire()
+        latencies = np.array(self._latencies)
+        stats = {
+            "published"   : self._published,
+            "dropped"     : self._dropped,
+            "connections" : self._connections,
+            "reuse"       : self._published / self._connections if self._connections > 0 else 0.0,
+        }
+        self._lock.release()
+        if len(latencies) > 0:
+            stats["p50"], stats["p99"], stats["max"] = np.percentile(latencies, (50, 99, 100)).tolist()
+        return stats
+
+    def shutdown(self):
+        """
+        Disconnect and stop the network thread.
+        """
+        self._client.disconnect()
+        self._client.loop_stop()
+        logging.info('publisher statistics: %s', self.statistics())
+        return
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self._lock.acquire()
+            self._connections = self._connections + 1
+            self._lock.release()
+            self._connected.set()
+            logging.info("publisher: connected.")
+        else:
+            logging.error("publisher: connection refused, rc=%s", rc)
+        return
+
+    def _on_disconnect(self, client, userdata, rc):
+        self._connected.clear()
+        if rc != 0:
+            logging.warning("publisher: connection lost, rc=%s, reconnecting.", rc)
+        return
+
+    def _on_publish(self, client, userdata, mid):
+        now = time.monotonic()
+        self._lock.acquire()
+        start = self._pending.pop(mid, None)
+        if start is not None:
+            self._latencies.append(now - start)
+        else:
+            self._early[mid] = now
+        self._lock.release()
+        return
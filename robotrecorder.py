@@ -0,0 +1,338 @@
+import os
+import sys
+import time
+import struct
+import logging
+import argparse
+import threading
+import numpy as np
+import paho.mqtt.client as mqtt
+
+from robotlog import setup_logging
+from robotpublisher import RobotPublisher
+
+# The recording file header: magic and version.
+#
+MAGIC   = b"RREC"
+VERSION = 1
+HEADER  = struct.Struct("<4sH")
+
+# The record header: wall time, QoS, topic length and payload length, followed by the topic
+# and the payload.
+#
+RECORD  = struct.Struct("<dBHI")
+
+# The topic suffixes that are not commands: the robot state and the acknowledgements, of a
+# single robot or of the robots of a fleet.
+#
+IGNORED = ("/state", "/ack")
+
+def parse(data, path=""):
+    """
+    Parse the commands of a recording.
+
+    Parameters
+    ----------
+    data : bytes
+        The recording file contents.
+    path : string, optional
+        The recording file path, for the error messages.
+
+    Returns
+    -------
+    tuple
+        The (timestamp, topic, payload, qos) commands and the end offset of the last complete
+        record, less than the data length if the last record is truncated.
+
+    Raises
+    ------
+    ValueError
+        If the data is not a recording.
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("invalid recording: {}".format(path))
+    magic, version = HEADER.unpack_from(data, 0)
+    if (magic != MAGIC) or (version != VERSION):
+        raise ValueError("invalid recording: {}".format(path))
+
+    records = []
+    offset  = HEADER.size
+    while offset + RECORD.size <= len(data):
+        timestamp, qos, tlen, plen = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        end   = start + tlen + plen
+        if end > len(data):
+            break
+        records.append((timestamp, data[start:start + tlen].decode(), data[start + tlen:end], qos))
+        offset = end
+    return records, offset
+
+class RobotRecorder:
+    """
+    This class implements the command recorder: it appends the timestamped MQTT commands to a
+    compact binary file. It can be used as a publisher, recording and forwarding the commands
+    to another publisher (i.e. a RobotPublisher), or fed with the messages of a broker
+    subscription.
+
+    The file is only appended to, several sessions can be recorded in the same file and a
+    session interrupted while writing only loses its last record.
+    """
+
+    def __init__ (self, path, publisher=None):
+        """
+        Open the recording file, creating it if it does not exist.
+
+        Parameters
+        ----------
+        path : string
+            The recording file path.
+        publisher : RobotPublisher, optional
+            The publisher the recorded commands are forwarded to, None (default) to only
+            record them.
+
+        Raises
+        ------
+        ValueError
+            If the file exists and it is not a recording.
+        """
+        # drop the last record of an interrupted session, the new ones follow the valid ones.
+        #
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb+") as f:
+                data = f.read()
+                _, end = parse(data, path)
+                if end != len(data):
+                    logging.warning("recording %s: truncated last record removed.", path)
+                    f.truncate(end)
+
+        self._lock      = threading.Lock()
+        self._publisher = publisher
+        self._records   = 0
+        self._file      = open(path, "ab", buffering=0)
+        if self._file.tell() == 0:
+            self._file.write(HEADER.pack(MAGIC, VERSION))
+        return
+
+    def record(self, topic, payload, qos=0, timestamp=None):
+        """
+        Append a command to the recording.
+
+        Parameters
+        ----------
+        topic : string
+            The command topic.
+        payload : string or bytes
+            The command payload.
+        qos : int, optional
+            The quality of service (default is 0).
+        timestamp : float, optional
+            The wall time of the command, None (default) for now.
+        """
+        topic   = topic.encode()
+        payload = payload.encode() if isinstance(payload, str) else bytes(payload or b"")
+        record  = RECORD.pack(time.time() if timestamp is None else timestamp, qos, len(topic), len(payload)) + topic + payload
+
+        # unbuffered, each record is written at once so a crash can only truncate the last one.
+        #
+        self._lock.acquire()
+        self._file.write(record)
+        self._records = self._records + 1
+        self._lock.release()
+        return
+
+    def publish(self, topic, payload=None, qos=0, wait=None):
+        """
+        Record a command and forward it to the publisher.
+
+        Parameters
+        ----------
+        topic : string
+            The command topic.
+        payload : string or bytes, optional
+            The command payload (default is None).
+        qos : int, optional
+            The quality of service (default is 0).
+        wait : float, optional
+            The maximum time in seconds to wait until the command has been sent, None
+            (default) to return right away.
+
+        Returns
+        -------
+        bool
+            True if the command has been handed over to the publisher.
+        """
+        self.record(topic, payload, qos)
+        if self._publisher is None:
+            return True
+        return self._publisher.publish(topic, payload, qos, wait)
+
+    def records(self):
+        """
+        Get the number of commands recorded.
+
+        Returns
+        -------
+        int
+            The number of commands recorded by this recorder.
+        """
+        return self._records
+
+    def close(self):
+        """
+        Close the recording file.
+        """
+        self._lock.acquire()
+        self._file.close()
+        self._lock.release()
+        logging.info("recorder: %s commands recorded.", self._records)
+        return
+
+
+class RobotRecording:
+    """
+    This class implements the recording reader.
+    """
+
+    def __init__ (self, path):
+        """
+        Read a recording.
+
+        Parameters
+        ----------
+        path : string
+            The recording file path.
+
+        Raises
+        ------
+        ValueError
+            If the file is not a recording.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        self._records, end = parse(data, path)
+        if end != len(data):
+            logging.warning("recording %s: truncated last record ignored.", path)
+        return
+
+    def records(self):
+        """
+        Get the recorded commands.
+
+        Returns
+        -------
+        list
+            The (timestamp, topic, payload, qos) commands in recording order.
+        """
+        return self._records
+
+    def duration(self):
+        """
+        Get the recording duration.
+
+        Returns
+        -------
+        float
+            The time between the first and the last command in seconds.
+        """
+        if not self._records:
+            return 0.0
+        return self._records[-1][0] - self._records[0][0]
+
+
+def replay(records, publisher, speed=1.0, max_gap=None):
+    """
+    Publish the recorded commands keeping their timing.
+
+    Parameters
+    ----------
+    records : list
+        The (timestamp, topic, payload, qos) commands.
+    publisher : RobotPublisher
+        The publisher of the commands.
+    speed : float, optional
+        The replay speed, 1.0 (default) for the recorded timing, 2.0 for twice as fast and so
+        on, 0.0 to publish as fast as possible.
+    max_gap : float, optional
+        The maximum recorded time between two commands in seconds, the longer idle periods
+        (i.e. between sessions) are shortened to it, None (default) to keep them.
+
+    Returns
+    -------
+    dict
+        The number of commands published, the replay duration in seconds, and the p50, p99
+        and maximum lag behind the schedule in seconds.
+    """
+    lags     = []
+    previous = None
+    offset   = 0.0
+    start    = time.monotonic()
+    for timestamp, topic, payload, qos in records:
+        if previous is not None:
+            gap = timestamp - previous
+            if (max_gap is not None) and (gap > max_gap):
+                gap = max_gap
+            offset = offset + max(gap, 0.0)
+        previous = timestamp
+        if speed > 0.0:
+            deadline = start + offset / speed
+            delay    = deadline - time.monotonic()
+            if delay > 0.0:
+                time.sleep(delay)
+            lags.append(time.monotonic() - deadline)
+        publisher.publish(topic, payload, qos)
+
+    stats = {"commands" : len(records), "duration" : time.monotonic() - start}
+    if lags:
+        stats["p50"], stats["p99"], stats["max"] = np.percentile(np.array(lags), (50, 99, 100)).tolist()
+    return stats
+
+def on_message(client, recorder, msg):
+    if not msg.topic.endswith(IGNORED):
+        recorder.record(msg.topic, msg.payload, msg.qos)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Robot command recorder and replayer.')
+    parser.add_argument('mode', choices=("record", "replay"), help="record the commands published to the broker or replay a recording")
+    parser.add_argument('path', help="recording file")
+    parser.add_argument('-x', '--speed', type=float, dest="speed", default=1.0, help="replay speed, 0 for as fast as possible")
+    parser.add_argument('-g', '--max-gap', type=float, dest="max_gap", default=None, help="shorten the idle periods longer than this many seconds")
+    parser.add_argument('-q', '--quit', action="store_true", dest="quit", default=False, help="also replay the quit commands")
+    parser.add_argument('-t', '--topic', dest="topic", default="robot/#", help="topics to record")
+    parser.add_argument('-H', '--host', dest="host", default="localhost", help="broker host")
+    parser.add_argument('-p', '--port', type=int, dest="port", default=1883, help="broker port")
+    args = parser.parse_args()
+
+    setup_logging(logging.INFO)
+
+    if args.mode == "record":
+        # record every command published to the broker until interrupted.
+        #
+        recorder = RobotRecorder(args.path)
+        client   = mqtt.Client(userdata=recorder)
+        client.on_message = on_message
+        client.connect(args.host, args.port, 60)
+        client.subscribe(args.topic, 2)
+        try:
+            client.loop_forever()
+        except KeyboardInterrupt:
+            pass
+        client.disconnect()
+        recorder.close()
+    else:
+        # replay the recording, without the quit commands unless asked for, so the robot
+        # keeps running for the next replay.
+        #
+        recording = RobotRecording(args.path)
+        records   = [record for record in recording.records() if args.quit or not record[1].endswith("/quit")]
+        logging.info("replaying %s commands, %.1fs recorded, at %sx.", len(records), recording.duration(), args.speed)
+        publisher = RobotPublisher(args.host, args.port)
+        if not publisher.wait_connected(10.0):
+            logging.error("broker not available.")
+            sys.exit(1)
+        stats = replay(records, publisher, args.speed, args.max_gap)
+        publisher.shutdown()
+        print("replayed : {} commands in {:.3f}s".format(stats["commands"], stats["duration"]))
+        if "p50" in stats:
+            print("lag      : p50={:.3f}ms p99={:.3f}ms max={:.3f}ms".format(stats["p50"] * 1000.0, stats["p99"] * 1000.0, stats["max"] * 1000.0))
+    sys.exit(0)
@@ -0,0 +1,118 @@
+import logging
+
+class RobotRouter:
+    """
+    This class implements a table-driven MQTT topic router: the handlers are registered once
+    by topic and every message costs a single dictionary lookup.
+    """
+
+    def __init__ (self):
+        """
+        Initialize an empty router.
+        """
+        self._routes  = {}
+        self._ignored = set()
+        return
+
+    def add(self, topic, handler, *args, lane="immediate", coalesce=None):
+        """
+        Register the handler of a topic.
+
+        Parameters
+        ----------
+        topic : string
+            The topic to handle.
+        handler : callable
+            The handler, called as handler(client, msg, *args).
+        *args :
+            The extra arguments passed to the handler.
+        lane : string, optional
+            The executor lane that runs the handler (default is "immediate").
+        coalesce : object, optional
+            The coalescing key of the messages, only the latest message with a given key
+            waiting to be executed is relevant. Either a key, a callable that gets the key
+            from the message payload or None (default) to never coalesce.
+        """
+        self._routes[topic] = (handler, args, lane, coalesce)
+        return
+
+    def ignore(self, topic):
+        """
+        Ignore the messages of a topic without reporting them as invalid commands, i.e. the
+        topics the robot publishes itself.
+
+        Parameters
+        ----------
+        topic : string
+            The topic to ignore.
+        """
+        self._ignored.add(topic)
+        return
+
+    def ignored(self, topic):
+        """
+        Check whether a topic is ignored.
+
+        Parameters
+        ----------
+        topic : string
+            The message topic.
+
+        Returns
+        -------
+        bool
+            True if the topic is ignored.
+        """
+        return topic in self._ignored
+
+    def topics(self):
+        """
+        Get the registered topics.
+
+        Returns
+        -------
+        list
+            The registered topics.
+        """
+        return list(self._routes)
+
+    def lookup(self, topic):
+        """
+        Find the handler of a topic.
+
+        Parameters
+        ----------
+        topic : string
+            The message topic.
+
+        Returns
+        -------
+        tuple
+            The (handler, args, lane, coalesce) registered for the topic, None if the topic is unknown.
+        """
+        return self._routes.get(topic)
+
+    def dispatch(self, client, msg):
+        """
+        Dispatch a message to the handler of its topic.
+
+        Parameters
+        ----------
+        client : mqtt.Client
+            The MQTT client that received the message.
+        msg : mqtt.MQTTMessage
+            The message to dispatch.
+
+        Returns
+        -------
+        bool
+            True if the topic has a handler.
+        """
+        route = self._routes.get(msg.topic)
+        if route is None:
+            if msg.topic not in self._ignored:
+                logging.error('invalid command: "%s"', msg.topic)
+            return False
+        handler, args, lane, coalesce = route
+        handler(client, msg, *args)
+        return True
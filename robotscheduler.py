@@ -0,0 +1,301 @@
+import logging
+import threading
+import contextlib
+
+from robotclock import RobotClock
+
+class RobotScheduler:
+    """
+    This class implements the motion scheduler: a single thread that ticks at a fixed rate,
+    advances the movement of every active servo in one pass and flushes the servo boards.
+    The ticks are scheduled against absolute monotonic deadlines, so they do not drift.
+    """
+
+    def __init__ (self, rate=100.0, clock=None):
+        """
+        Initialize the motion scheduler.
+
+        Parameters
+        ----------
+        rate : float, optional
+            The scheduler tick rate in Hz (default is 100.0).
+        clock : RobotClock, optional
+            The clock driving the ticks, None (default) for the wall clock.
+
+        """
+        self._clock      = clock if clock is not None else RobotClock()
+        self._rate       = rate
+        self._period     = 1.0 / rate
+        self._cv         = threading.Condition()
+        self._tickLock   = threading.RLock()
+        self._batch      = None
+        self._batchTime  = 0.0
+        self._active     = {}
+        self._boards     = []
+        self._dirty      = False
+        self._thread     = None
+        self._shutdown   = False
+        self._ticks      = 0
+        self._overruns   = 0
+        self._lateness   = 0.0
+        self._maxLate    = 0.0
+        self._deadlines  = 0
+        return
+
+    def start(self):
+        """
+        Start the scheduler thread if it is not already running.
+        """
+        self._cv.acquire()
+        if self._thread is None:
+            self._shutdown = False
+            self._thread   = threading.Thread(target=self.run, name="RobotScheduler")
+            self._thread.daemon = True
+            self._thread.start()
+        self._cv.release()
+        return
+
+    def shutdown(self):
+        """
+        Stop the scheduler thread and wait until it has finished.
+        """
+        self._cv.acquire()
+        thread = self._thread
+        self._shutdown = True
+        self._cv.notify()
+        self._cv.release()
+
+        if thread is not None:
+            thread.join()
+
+        self._cv.acquire()
+        self._thread = None
+        self._cv.release()
+        return
+
+    def rate(self):
+        """
+        Get the scheduler tick rate.
+
+        Returns
+        -------
+        float
+            The tick rate in Hz.
+        """
+        return self._rate
+
+    def period(self):
+        """
+        Get the scheduler tick period.
+
+        Returns
+        -------
+        float
+            The tick period in seconds.
+        """
+        return self._period
+
+    def clock(self):
+        """
+        Get the clock driving the ticks.
+
+        Returns
+        -------
+        RobotClock
+            The scheduler clock.
+        """
+        return self._clock
+
+    def now(self):
+        """
+        Get the scheduler clock.
+
+        Returns
+        -------
+        float
+            The current time in seconds, frozen at the batch start for the thread running a
+            batch.
+        """
+        if self._batch is threading.current_thread():
+            return self._batchTime
+        return self._clock.now()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager to apply several moves within the same tick: the ticks are held back
+        while the batch runs and all the moves share the same start time.
+        """
+        self._tickLock.acquire()
+        nested = self._batch is threading.current_thread()
+        if not nested:
+            self._batchTime = self._clock.now()
+            self._batch     = threading.current_thread()
+        try:
+            yield
+        finally:
+            if not nested:
+                self._batch = None
+            self._tickLock.release()
+
+    def statistics(self):
+        """
+        Get the scheduler timing statistics.
+
+        Returns
+        -------
+        dict
+            The number of ticks, the number of deadlines missed and the mean and maximum
+            lateness of the deadline ticks in seconds.
+        """
+        self._cv.acquire()
+        stats = {
+            "ticks"         : self._ticks,
+            "overruns"      : self._overruns,
+            "mean_lateness" : self._lateness / self._deadlines if self._deadlines > 0 else 0.0,
+            "max_lateness"  : self._maxLate,
+        }
+        self._cv.release()
+        return stats
+
+    def add_board(self, board):
+        """
+        Register a servo board to be flushed at the end of every tick.
+
+        Parameters
+        ----------
+        board : RobotServoBackend
+            The servo board.
+        """
+        self._cv.acquire()
+        if board not in self._boards:
+            self._boards.append(board)
+        self._cv.release()
+        return
+
+    def wakeup(self):
+        """
+        Request a tick to flush the servo boards, used after direct writes.
+        """
+        self._cv.acquire()
+        self._dirty = True
+        self._cv.notify()
+        self._cv.release()
+        return
+
+    def activate(self, servo):
+        """
+        Register a servo with a pending movement, it will be stepped on every tick until its
+        movement is done. Any task with a step(now) method returning False once done (e.g. a
+        choreography player) can be activated as well.
+
+        Parameters
+        ----------
+        servo : RobotServo
+            The servo to step.
+        """
+        self._cv.acquire()
+        self._active[servo] = self._active.get(servo, 0) + 1
+        self._dirty = True
+        self._cv.notify()
+        self._cv.release()
+        return
+
+    def tick(self):
+        """
+        Perform a single scheduler pass, stepping all the active servos and flushing all the
+        channel updates produced by them.
+
+        Returns
+        -------
+        bool
+            True if there are still active servos.
+        """
+        self._tickLock.acquire()
+        now = self._clock.now()
+
+        self._cv.acquire()
+        active = list(self._active.items())
+        boards = list(self._boards)
+        self._dirty = False
+        self._cv.release()
+
+        done = [(servo, count) for servo, count in active if not servo.step(now)]
+
+        for board in boards:
+            board.flush()
+        self._tickLock.release()
+
+        self._cv.acquire()
+        for servo, count in done:
+            # keep the servos that have been activated again while stepping.
+            #
+            if self._active.get(servo) == count:
+                del self._active[servo]
+        pending = len(self._active) > 0
+        self._ticks = self._ticks + 1
+        self._cv.release()
+
+        return pending
+
+    def run(self):
+        """
+        Scheduler thread entry point.
+        """
+        logging.debug ("scheduler: starting at %s Hz.", self._rate)
+        deadline = None
+        while True:
+
+            # wait until there is something to move, the deadlines restart after being idle.
+            #
+            self._cv.acquire()
+            while (not self._active) and (not self._dirty) and (not self._shutdown):
+                self._cv.wait()
+                deadline = None
+            shutdown = self._shutdown
+            self._cv.release()
+
+            if shutdown:
+                break
+
+            # a tick is either the one due at the current deadline or an extra one requested
+            # to flush a direct write or to start a new movement right away.
+            #
+            now = self.now()
+            if deadline is None:
+                deadline = now
+            if now >= deadline:
+                late = now - deadline
+                if late >= self._period:
+                    # skip the deadlines already missed instead of bursting to catch up.
+                    #
+                    missed   = (int)(late / self._period)
+                    deadline = deadline + missed * self._period
+                    self._cv.acquire()
+                    self._overruns = self._overruns + missed
+                    self._cv.release()
+                deadline = deadline + self._period
+                self._cv.acquire()
+                self._deadlines = self._deadlines + 1
+                self._lateness  = self._lateness + late
+                self._maxLate   = max(self._maxLate, late)
+                self._cv.release()
+
+            # step all the active servos and wait for the next deadline.
+            #
+            if self.tick():
+                self._cv.acquire()
+                while (not self._shutdown) and (not self._dirty):
+                    timeout = deadline - self.now()
+                    if timeout <= 0.0:
+                        break
+                    self._clock.wait(self._cv, timeout)
+                self._cv.release()
+
+        # flush the last writes (i.e. the servos moved to their initial position).
+        #
+        for board in self._boards:
+            board.flush()
+
+        logging.debug ("scheduler: finished after %s ticks.", self._ticks)
+        return
@@ -1,15 +1,15 @@
-
-import time
 import logging
 import threading
-from SunFounder_PCA9685 import Servo
+from robottrajectory import RobotTrajectory
 
-class RobotServo(threading.Thread):
+class RobotServo:
     """
-    This class implements the robot servo methods.
+    This class implements the robot servo methods. The movements are performed by the motion
+    scheduler, that steps all the active servos from a single thread and flushes their writes
+    to the servo board once per tick.
     """
 
-    def __init__ (self, servoId, zeroAngle, oneAngle, globalLock):
+    def __init__ (self, servoId, zeroAngle, oneAngle, board, scheduler):
         """
         Initialize the robot servo instance
 
@@ -21,44 +21,55 @@ class RobotServo(threading.Thread):
             The motor angle that corresponds to the position 0.0
         oneAngle : float
             The motor angle that corresponds to the position 1.0
-        globalLock : 
-            The global thread lock to be used when writing the servo commands.
+        board : RobotServoBackend
+            The servo board the motor is connected to.
+        scheduler : RobotScheduler
+            The motion scheduler that performs the stepped movements.
 
         """
-        threading.Thread.__init__(self)
         self._servoId    = servoId
-        self._servo      = Servo.Servo(servoId)
+        self._board      = board
         self._zeroAngle  = zeroAngle
         self._oneAngle   = oneAngle
-        self._globalLock = globalLock
+        self._scheduler  = scheduler
         self._cvmove     = threading.Condition()
-        self._cvstop     = threading.Condition()
         self._operate    = False
-        self._stop       = False
-        self._target     = 0.0
-        self._speed      = 0.0
-        self._steps      = 0
-        self._shutdown   = False
+        self._profile    = "linear"
+        self._retarget   = False
+        self._trajectory = None
+        self._angles     = None
+        self._start      = 0.0
+        self._index      = -1
+        self._timing     = None
+        self._samples    = 0
+        self._lateSum    = 0.0
+        self._lateSq     = 0.0
+        self._lateMax    = 0.0
         self._position   = 0.0
         self._initial    = 0.0
+        self._angle      = None
+        self._written    = 0
+        self._suppressed = 0
+        self._callbacks  = []
+        self._writers    = []
         return
 
     def initialize(self):
         """
         Initialize the motor, move the motors to its initial state.
         """
-        self._globalLock.acquire()
-        self._servo.setup()
-        self._globalLock.release()
+        self._board.setup()
+        self._angle    = None
         self._position = -1.0
-        self.start()
+        self._scheduler.add_board(self._board)
+        self._scheduler.start()
         return
     
     def shutdown(self):
         """
         Shutdown the motor and clean everything.
         """
-        logging.debug ("shutdown({}).".format(self._servoId))
+        logging.debug ("shutdown(%s).", self._servoId)
         self._cvmove.acquire()
         
         # wait for pending operations.
@@ -66,20 +77,19 @@ class RobotServo(threading.Thread):
         while self._operate:
             self._cvmove.wait()
 
-        # set the shutdown flag and wakeup the servo thread.
+        # move the motor to its initial position.
         #
-        self._shutdown = True
-        self._operate  = True
-        self._cvmove.notify()
-        
+        if self._write(self._initial):
+            self._scheduler.wakeup()
+
         self._cvmove.release()
-        logging.debug ("shutdown({}): done.".format(self._servoId))
+        logging.debug ("shutdown(%s): done.", self._servoId)
 
         return
     
     def position(self):
         """
-        Initialize the motor, move the motors to its initial state.
+        Get the current motor position.
 
         Returns
         -------
@@ -91,7 +101,82 @@ class RobotServo(threading.Thread):
         self._cvmove.release()
         return position
 
-    def move(self, position, speed=0.0, steps=10):
+    def snapshot(self):
+        """
+        Get a consistent snapshot of the motor state.
+
+        Returns
+        -------
+        tuple
+            The current position, the target position and True if a stepped movement is in
+            progress.
+        """
+        self._cvmove.acquire()
+        if self._operate:
+            snapshot = (self._position, self._trajectory.target(), True)
+        else:
+            snapshot = (self._position, self._position, False)
+        self._cvmove.release()
+        return snapshot
+
+    def statistics(self):
+        """
+        Get the write statistics of the motor.
+
+        Returns
+        -------
+        dict
+            The number of writes sent to the board and the number of writes suppressed
+            because the motor angle did not change.
+        """
+        self._cvmove.acquire()
+        stats = {"written" : self._written, "suppressed" : self._suppressed}
+        self._cvmove.release()
+        return stats
+
+    def timing(self):
+        """
+        Get the timing statistics of the last completed stepped movement.
+
+        Returns
+        -------
+        dict
+            The planned and measured duration, the overrun, and the mean, maximum and
+            standard deviation (jitter) of the sample lateness against their deadlines, all
+            in seconds. None if no stepped movement has completed yet.
+        """
+        self._cvmove.acquire()
+        timing = self._timing
+        self._cvmove.release()
+        return timing
+
+    def set_profile(self, profile):
+        """
+        Set the default trajectory profile of the stepped movements.
+
+        Parameters
+        ----------
+        profile : string
+            The trajectory profile, one of robottrajectory.PROFILES.
+        """
+        self._profile = profile
+        return
+
+    def set_retarget(self, enabled):
+        """
+        Set the "latest target wins" mode. When enabled, a new move does not wait for the
+        current one: it retargets the running trajectory from the current position and
+        returns immediately.
+
+        Parameters
+        ----------
+        enabled : bool
+            True to enable the retarget mode.
+        """
+        self._retarget = enabled
+        return
+
+    def move(self, position, speed=0.0, steps=10, profile=None, retarget=None, on_write=None):
         """
         Start moving the motor to a given position with a given speed/steps.
 
@@ -103,75 +188,264 @@ class RobotServo(threading.Thread):
             The movement speed in units per second. A value 0.0 (default) indicates to perform a direct move without any step.
         steps : int, optional
             The number of steps to perform (default is 10).
+        profile : string, optional
+            The trajectory profile, None (default) to use the servo default profile.
+        retarget : bool, optional
+            True to retarget the current movement instead of waiting for it, None (default)
+            to use the servo retarget mode.
+        on_write : callable, optional
+            A callback called without arguments once the first angle of this movement is
+            handed over to the board, or once it reaches its target if the angle was already
+            on the board, while the servo lock is held so it must be short. It is dropped if
+            the movement is stopped or cancelled before writing.
 
         """
-        logging.debug ("move({}): position={} speed={} steps={}.".format(self._servoId, position, speed, steps))
+        logging.debug ("move(%s): position=%s speed=%s steps=%s profile=%s.", self._servoId, position, speed, steps, profile)
+        callbacks = []
         self._cvmove.acquire()
-        
-        # wait for pending operations.
-        #
-        while self._operate:
-            self._cvmove.wait()
+        try:
+            if retarget is None:
+                retarget = self._retarget
 
-        if speed == 0.0:
-            # direct move.
-            #
-            self._globalLock.acquire()
-            self._servo.write(self._to_angle(position))
-            self._globalLock.release()
-            self._position = position
-        else:
-            # set the target position and wakeup the servo thread.
-            #
-            self._target  = position
-            self._speed   = speed
-            self._steps   = steps
-            self._operate = True
-            self._cvmove.notify()
-        
-        self._cvmove.release()
-        logging.debug ("move({}): done.".format(self._servoId))
+            if not retarget:
+                # wait for pending operations.
+                #
+                while self._operate:
+                    self._cvmove.wait()
+            elif self._operate:
+                # cancel the current movement, a stepped move replaces it and otherwise the
+                # scheduler will drop it on its next tick.
+                #
+                logging.debug ("move(%s): cancelled at current=%s", self._servoId, self._position)
+                callbacks = self._finish()
+
+            if on_write is not None:
+                self._writers.append(on_write)
+
+            if speed == 0.0:
+                # direct move, the angle may already be the one on the board.
+                #
+                if self._write(position):
+                    self._scheduler.wakeup()
+                else:
+                    self._fire_writers()
+                self._position = position
+            else:
+                # precompute the trajectory and its motor angles from the current position and
+                # hand over the movement to the scheduler, replacing any movement in progress.
+                #
+                trajectory       = RobotTrajectory(self._position, position, speed, steps, profile or self._profile)
+                self._angles     = ((self._oneAngle - self._zeroAngle) * trajectory.positions() + self._zeroAngle).astype(int)
+                self._trajectory = trajectory
+                self._start      = self._scheduler.now()
+                self._index      = -1
+                self._samples    = 0
+                self._lateSum    = 0.0
+                self._lateSq     = 0.0
+                self._lateMax    = 0.0
+                self._operate    = True
+                self._scheduler.activate(self)
+        finally:
+            self._cvmove.release()
+        for callback in callbacks:
+            callback()
+        logging.debug ("move(%s): done.", self._servoId)
         return
 
     def wait(self):
         """
         Wait until a pending move is completed.
         """
-        logging.debug ("wait({}): start.".format(self._servoId))
+        logging.debug ("wait(%s): start.", self._servoId)
         self._cvmove.acquire()
         
-        # wait until the thread has completed.
+        # wait until the movement has completed.
         #
         while self._operate:
             self._cvmove.wait()
             
         self._cvmove.release()
-        logging.debug ("wait({}): done.".format(self._servoId))
+        logging.debug ("wait(%s): done.", self._servoId)
         return
 
     def stop(self):
         """
         Stop the current movement.
         """
-        logging.debug ("stop{}): start.".format(self._servoId))
+        logging.debug ("stop(%s): start.", self._servoId)
+        callbacks = []
         self._cvmove.acquire()
         
-        # stop the current movement.
+        # stop the current movement, the scheduler will drop it on its next tick.
         #
-        self._cvstop.acquire()
-        self._stop = True
-        self._cvstop.notify()
-        self._cvstop.release()
-        
-        # wait until the thread has completed.
-        #
-        while self._operate:
-            self._cvmove.wait()
+        if self._operate:
+            logging.debug ("stop(%s): stopped at current=%s", self._servoId, self._position)
+            callbacks = self._finish()
             
         self._cvmove.release()
-        logging.debug ("stop({}): done.".format(self._servoId))
+        for callback in callbacks:
+            callback()
+        logging.debug ("stop(%s): done.", self._servoId)
+        return
+
+    def step(self, now):
+        """
+        Advance the current movement, called by the scheduler on every tick.
+
+        Parameters
+        ----------
+        now : float
+            The scheduler time of the current tick.
+
+        Returns
+        -------
+        bool
+            True if the movement is still in progress.
+        """
+        callbacks = []
+        self._cvmove.acquire()
+
+        if self._operate:
+            elapsed = now - self._start
+            index   = self._trajectory.index(elapsed)
+            if index > self._index:
+                # write the last sample due, measuring how late it is against its deadline.
+                #
+                late = elapsed - float(self._trajectory.times()[index])
+                self._samples  = self._samples + 1
+                self._lateSum  = self._lateSum + late
+                self._lateSq   = self._lateSq + late * late
+                self._lateMax  = max(self._lateMax, late)
+                self._position = float(self._trajectory.positions()[index])
+                self._index    = index
+                logging.debug ("step(%s): current=%s", self._servoId, self._position)
+                self._write_angle(int(self._angles[index]))
+
+            if elapsed >= self._trajectory.duration():
+                # movement done, store its timing and wakeup people waiting.
+                #
+                logging.debug ("step(%s): completed at current=%s", self._servoId, self._position)
+                self._complete(elapsed)
+                self._fire_writers()
+                callbacks = self._finish()
+
+        operate = self._operate
+        self._cvmove.release()
+        for callback in callbacks:
+            callback()
+        return operate
+
+    def add_done_callback(self, callback):
+        """
+        Register a callback to be called once the current movement is completed, stopped or
+        cancelled by a new target, right away if there is no movement in progress. The
+        callback is called without arguments from the thread ending the movement, usually
+        the scheduler thread, so it must not block.
+
+        Parameters
+        ----------
+        callback : callable
+            The callback.
+        """
+        self._cvmove.acquire()
+        operate = self._operate
+        if operate:
+            self._callbacks.append(callback)
+        self._cvmove.release()
+        if not operate:
+            callback()
+        return
+
+    def _finish(self):
+        """
+        End the current movement and wakeup people waiting, the lock must be held.
+
+        Returns
+        -------
+        list
+            The done callbacks to call once the lock is released.
+        """
+        self._operate = False
+        self._writers = []
+        self._cvmove.notify_all()
+        callbacks, self._callbacks = self._callbacks, []
+        return callbacks
+
+    def _fire_writers(self):
+        """
+        Call the write callbacks pending, the lock must be held. Used when the movement
+        reaches its target without writing, because the angle was already on the board.
+        """
+        writers, self._writers = self._writers, []
+        for writer in writers:
+            writer()
         return
 
+    def _complete(self, elapsed):
+        """
+        Compute the timing statistics of the completed movement.
+
+        Parameters
+        ----------
+        elapsed : float
+            The measured movement duration.
+        """
+        mean     = self._lateSum / self._samples
+        variance = max(self._lateSq / self._samples - mean * mean, 0.0)
+        self._timing = {
+            "planned"       : self._trajectory.duration(),
+            "measured"      : elapsed,
+            "overrun"       : elapsed - self._trajectory.duration(),
+            "samples"       : self._samples,
+            "skipped"       : len(self._trajectory.times()) - self._samples,
+            "mean_lateness" : mean,
+            "max_lateness"  : self._lateMax,
+            "jitter"        : variance ** 0.5,
+        }
+        logging.debug ("step(%s): timing=%s", self._servoId, self._timing)
+        return
+
+    def _write(self, position):
+        """
+        Write a position to the motor, the board buffers it until the next scheduler flush.
+        The write is suppressed when the motor angle is the last one written.
+
+        Parameters
+        ----------
+        position : float
+            The servo position to write.
+
+        Returns
+        -------
+        bool
+            True if the angle has been sent to the board.
+        """
+        return self._write_angle(self._to_angle(position))
+
+    def _write_angle(self, angle):
+        """
+        Write a motor angle, suppressing it when it is the last one written.
+
+        Parameters
+        ----------
+        angle : int
+            The motor angle to write.
+
+        Returns
+        -------
+        bool
+            True if the angle has been sent to the board.
+        """
+        if angle == self._angle:
+            self._suppressed = self._suppressed + 1
+            return False
+        self._board.write(self._servoId, angle)
+        self._angle   = angle
+        self._written = self._written + 1
+        if self._writers:
+            self._fire_writers()
+        return True
+
     def _to_angle(self, position):
         """
         Converts a position to its motor angle.
@@ -188,67 +462,3 @@ class RobotServo(threading.Thread):
         """
         angle = (self._oneAngle - self._zeroAngle) * position + self._zeroAngle
         return (int)(angle)
-
-    def run(self):
-        """
-        Move thread entry point.
-        """
-        logging.debug ("run({}): starting.".format(self._servoId))
-        while not self._shutdown:
-            
-            logging.debug ("run({}): waiting movement.".format(self._servoId))
-            
-            # wait until a movement is requested.
-            #
-            self._cvmove.acquire()
-            while not self._operate:
-                self._cvmove.wait()
-            self._cvmove.release()
-            
-            if not self._shutdown:
-                # perform the movement.
-                #
-                logging.debug ("run({}): target={}, speed={}, steps={})".format(self._servoId, self._target, self._speed ,self._steps))
-                
-                # compute the increment for each step and the delay to use.
-                #
-                increment = (self._target - self._position) / self._steps
-                delay     = (abs(self._target - self._position) / self._speed) / self._steps
-
-                # start moving...
-                #
-                self._cvmove.acquire()
-                current = self._position + increment
-                self._stop = False
-                while ((not self._stop) and (self._steps > 0)):
-                    logging.debug ("run({}): current={})".format(self._servoId, current))
-                    self._globalLock.acquire()
-                    self._servo.write(self._to_angle(current))
-                    self._globalLock.release()
-                    current = current + increment
-                    self._steps = self._steps - 1
-                    self._cvmove.wait(delay)
-
-                # movement done, store the position.
-                #
-                if self._stop:
-                    logging.debug ("run({}): stopped at current={})".format(self._servoId, current))
-                    self._position = current
-                else:
-                    logging.debug ("run({}): completed at current={})".format(self._servoId, self._target))
-                    self._position = self._target
-                self._cvmove.release()
-                        
-                logging.debug ("run({}): done.".format(self._servoId))
-            
-                # we are not operate anymore and wakeup people waiting
-                #
-                self._cvmove.acquire()
-                self._operate = False
-                self._cvmove.notify()
-                self._cvmove.release()
-            
-        logging.debug ("run({}): finished.".format(self._servoId))
-        self._servo.write(self._to_angle(self._initial))
-
-        return
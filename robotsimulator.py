@@ -0,0 +1,116 @@
+import collections
+
+from robotbackend import RobotServoBackend
+
+class RobotSimulatedPCA9685(RobotServoBackend):
+    """
+    This class implements an in-memory PCA9685 servo board. The latest channel writes are
+    recorded with their timestamp, so the motion stack can be benchmarked and tested without
+    hardware.
+    """
+
+    def __init__ (self, globalLock, address=0x40, clock=None, history=10000):
+        """
+        Initialize the simulated servo board.
+
+        Parameters
+        ----------
+        globalLock :
+            The global thread lock to be used when writing to the board.
+        address : int, optional
+            The simulated I2C address of the board (default is 0x40).
+        clock : RobotClock, optional
+            The clock used to timestamp the writes, None (default) for the wall clock.
+        history : int, optional
+            The number of latest writes recorded (default is 10000), the older ones are
+            forgotten so a long running simulation does not grow without bound.
+
+        """
+        RobotServoBackend.__init__(self, globalLock, clock)
+        self._address  = address
+        self._records  = collections.deque(maxlen=history)
+        self._angles   = {}
+        return
+
+    def address(self):
+        """
+        Get the simulated I2C address.
+
+        Returns
+        -------
+        int
+            The board address.
+        """
+        return self._address
+
+    def records(self, channel=None):
+        """
+        Get the latest recorded writes.
+
+        Parameters
+        ----------
+        channel : int, optional
+            The channel to get the writes of, None (default) for all the channels.
+
+        Returns
+        -------
+        list
+            A list of (time, channel, angle) tuples in write order.
+        """
+        self._globalLock.acquire()
+        if channel is None:
+            records = list(self._records)
+        else:
+            records = [record for record in self._records if record[1] == channel]
+        self._globalLock.release()
+        return records
+
+    def angle(self, channel):
+        """
+        Get the current angle of a channel.
+
+        Parameters
+        ----------
+        channel : int
+            The servo channel.
+
+        Returns
+        -------
+        int
+            The last angle written to the channel, None if it was never written.
+        """
+        self._globalLock.acquire()
+        angle = self._angles.get(channel)
+        self._globalLock.release()
+        return angle
+
+    def clear(self):
+        """
+        Forget the recorded writes.
+        """
+        self._globalLock.acquire()
+        self._records.clear()
+        self._globalLock.release()
+        return
+
+    def _setup(self):
+        """
+        Setup the simulated board, there is nothing to do.
+        """
+        return
+
+    def _send(self, blocks):
+        """
+        Record each channel of the blocks with the current time.
+
+        Parameters
+        ----------
+        blocks : list
+            A list of (first channel, angles) tuples.
+        """
+        now = self._clock.now()
+        for first, angles in blocks:
+            for channel, angle in enumerate(angles, first):
+                self._records.append((now, channel, angle))
+                self._angles[channel] = angle
+        return
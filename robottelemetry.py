@@ -0,0 +1,135 @@
+import json
+import time
+import logging
+import threading
+
+# Decimals of the published positions, smaller changes are not worth a message.
+#
+PRECISION = 3
+
+class RobotTelemetry:
+    """
+    This class implements the robot state telemetry: a snapshot of all the joints (position,
+    target and motion state) is taken at a fixed rate and published as a single compact JSON
+    message, only when the state has changed since the last one published.
+    """
+
+    def __init__ (self, robot, client, rate=10.0, topic="robot/state"):
+        """
+        Initialize the telemetry.
+
+        Parameters
+        ----------
+        robot : Robot
+            The robot to observe.
+        client : mqtt.Client
+            The MQTT client publishing the state.
+        rate : float, optional
+            The sampling rate in Hz (default is 10.0).
+        topic : string, optional
+            The state topic (default is "robot/state").
+        """
+        self._robot     = robot
+        self._client    = client
+        self._period    = 1.0 / rate
+        self._topic     = topic
+        self._last      = None
+        self._seq       = 0
+        self._sampled   = 0
+        self._published = 0
+        self._stop      = threading.Event()
+        self._thread    = None
+        return
+
+    def topic(self):
+        """
+        Get the state topic.
+
+        Returns
+        -------
+        string
+            The state topic.
+        """
+        return self._topic
+
+    def period(self):
+        """
+        Get the sampling period.
+
+        Returns
+        -------
+        float
+            The sampling period in seconds.
+        """
+        return self._period
+
+    def poll(self):
+        """
+        Take a snapshot of the robot state and publish it if it has changed.
+
+        Returns
+        -------
+        bool
+            True if the state has been published.
+        """
+        self._sampled = self._sampled + 1
+        joints = {}
+        for joint, (position, target, moving) in self._robot.snapshot().items():
+            joints[joint] = [round(position, PRECISION), round(target, PRECISION), 1 if moving else 0]
+        if joints == self._last:
+            return False
+
+        self._last = joints
+        self._seq  = self._seq + 1
+        payload = json.dumps({"seq" : self._seq, "time" : time.time(), "joints" : joints}, separators=(",", ":"))
+        self._client.publish(self._topic, payload)
+        self._published = self._published + 1
+        return True
+
+    def statistics(self):
+        """
+        Get the telemetry statistics.
+
+        Returns
+        -------
+        dict
+            The number of snapshots taken and published.
+        """
+        return {"sampled" : self._sampled, "published" : self._published}
+
+    def start(self):
+        """
+        Start publishing from a background thread.
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="RobotTelemetry")
+            self._thread.daemon = True
+            self._thread.start()
+        return
+
+    def stop(self):
+        """
+        Stop the background thread.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            logging.info('telemetry statistics: %s', self.statistics())
+        return
+
+    def run(self):
+        """
+        Telemetry thread entry point.
+        """
+        deadline = time.monotonic()
+        while True:
+            deadline = max(deadline + self._period, time.monotonic())
+            if self._stop.wait(max(deadline - time.monotonic(), 0.0)):
+                break
+            try:
+                self.poll()
+            except Exception:
+                logging.exception("telemetry: publish failed.")
+        return
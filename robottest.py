@@ -2,9 +2,12 @@
 from robothead import RobotHead
 from robotbody import RobotBody
 from robotservo import RobotServo
+from robotscheduler import RobotScheduler
+from robotbackend import create_backend
 import threading
 import time
 import logging
+from robotlog import setup_logging
 
 if __name__ == "__main__":
     #robothead = RobotHead()
@@ -12,29 +15,31 @@ if __name__ == "__main__":
     #robotbody.initialize()
 
     format = "%(asctime)s: %(message)s"
-    logging.basicConfig(format=format, level=logging.DEBUG, datefmt="%H:%M:%S")
+    setup_logging(logging.DEBUG, format)
     
     globalLock = threading.Lock()
+    board      = create_backend("pca9685", globalLock)
+    scheduler  = RobotScheduler()
     
-    right = RobotServo(0,0,100, globalLock)
+    right = RobotServo(0,0,100, board, scheduler)
     right.initialize()
 
-    left = RobotServo(1,100,0,globalLock)
+    left = RobotServo(1,100,0, board, scheduler)
     left.initialize()
 
-    neck = RobotServo(2, 110, 180, globalLock)
+    neck = RobotServo(2, 110, 180, board, scheduler)
     neck.initialize()
 
-    neckBodyUD = RobotServo(3,120, 95, globalLock)
+    neckBodyUD = RobotServo(3,120, 95, board, scheduler)
     neckBodyUD.initialize()
 
-    neckBodyLR = RobotServo(4,0,180, globalLock)
+    neckBodyLR = RobotServo(4,0,180, board, scheduler)
     neckBodyLR.initialize()
 
-    leftEye    = RobotServo(5, 65, 50, globalLock)
+    leftEye    = RobotServo(5, 65, 50, board, scheduler)
     leftEye.initialize()
 
-    rightEye   = RobotServo(6,110,140, globalLock)
+    rightEye   = RobotServo(6,110,140, board, scheduler)
     rightEye.initialize()
 
     
@@ -94,6 +99,7 @@ if __name__ == "__main__":
     neckBodyLR.shutdown()
     leftEye.shutdown()
     rightEye.shutdown()
+    scheduler.shutdown()
     
     
 
@@ -0,0 +1,188 @@
+import numpy as np
+
+# Supported trajectory profiles.
+#
+PROFILES = ("linear", "trapezoidal", "minimum_jerk")
+
+# Fraction of the move spent accelerating (and decelerating) in the trapezoidal profile.
+#
+TRAPEZOIDAL_RAMP = 0.25
+
+# Maximum number of steps of a move, bounds the samples precomputed per move.
+#
+MAX_STEPS = 1000
+
+class RobotTrajectory:
+    """
+    This class implements a servo trajectory: the (time, position) samples of a move, computed
+    once when the move starts so that the scheduler only has to index into them.
+    """
+
+    def __init__ (self, start, target, speed, steps, profile="linear"):
+        """
+        Compute the trajectory samples.
+
+        Parameters
+        ----------
+        start : float
+            The initial servo position.
+        target : float
+            The final servo position.
+        speed : float
+            The peak speed in units per second.
+        steps : int
+            The number of steps to perform, at most MAX_STEPS.
+        profile : string, optional
+            The trajectory profile, one of PROFILES (default is "linear").
+
+        Raises
+        ------
+        ValueError
+            If the profile, the speed or the steps are not valid.
+
+        """
+        if profile not in PROFILES:
+            raise ValueError("invalid trajectory profile: {}".format(profile))
+        if not (0.0 < speed < float("inf")) or not (0 < steps <= MAX_STEPS):
+            raise ValueError("invalid speed/steps: {}/{}".format(speed, steps))
+
+        # the move duration that keeps the peak speed of the profile at the requested speed.
+        #
+        duration = _peak(profile) * abs(target - start) / speed
+        delta    = duration / steps
+
+        # sample k is written at time k * delta and already holds the position expected at the
+        # end of the step, the last sample is the target itself.
+        #
+        times = np.arange(steps + 1) * delta
+        if duration > 0.0:
+            tau = np.minimum((times + delta) / duration, 1.0)
+        else:
+            tau = np.ones(steps + 1)
+
+        self._profile   = profile
+        self._target    = target
+        self._duration  = duration
+        self._times     = times
+        self._positions = start + (target - start) * _normalized(profile, tau)
+        self._positions[-1] = target
+        return
+
+    def profile(self):
+        """
+        Get the trajectory profile.
+
+        Returns
+        -------
+        string
+            The profile name.
+        """
+        return self._profile
+
+    def target(self):
+        """
+        Get the final position.
+
+        Returns
+        -------
+        float
+            The target position.
+        """
+        return self._target
+
+    def duration(self):
+        """
+        Get the trajectory duration.
+
+        Returns
+        -------
+        float
+            The duration in seconds.
+        """
+        return self._duration
+
+    def times(self):
+        """
+        Get the sample times.
+
+        Returns
+        -------
+        numpy.ndarray
+            The time of each sample relative to the move start.
+        """
+        return self._times
+
+    def positions(self):
+        """
+        Get the sample positions.
+
+        Returns
+        -------
+        numpy.ndarray
+            The position of each sample.
+        """
+        return self._positions
+
+    def index(self, elapsed):
+        """
+        Get the sample to write at a given time.
+
+        Parameters
+        ----------
+        elapsed : float
+            The time elapsed since the move start.
+
+        Returns
+        -------
+        int
+            The index of the last sample due, -1 if none is due yet.
+        """
+        return int(np.searchsorted(self._times, elapsed, side="right")) - 1
+
+
+def _peak(profile):
+    """
+    Get the peak normalized speed of a profile, 1.0 being the speed of the linear profile.
+
+    Parameters
+    ----------
+    profile : string
+        The profile name.
+
+    Returns
+    -------
+    float
+        The peak normalized speed.
+    """
+    if profile == "trapezoidal":
+        return 1.0 / (1.0 - TRAPEZOIDAL_RAMP)
+    elif profile == "minimum_jerk":
+        return 1.875
+    return 1.0
+
+def _normalized(profile, tau):
+    """
+    Evaluate a profile over normalized time.
+
+    Parameters
+    ----------
+    profile : string
+        The profile name.
+    tau : numpy.ndarray
+        The normalized times in the range [0.0, 1.0].
+
+    Returns
+    -------
+    numpy.ndarray
+        The normalized positions in the range [0.0, 1.0].
+    """
+    if profile == "trapezoidal":
+        ramp = TRAPEZOIDAL_RAMP
+        peak = _peak(profile)
+        return np.select(
+            [tau < ramp, tau <= 1.0 - ramp],
+            [peak * tau * tau / (2.0 * ramp), peak * (tau - ramp / 2.0)],
+            1.0 - peak * (1.0 - tau) ** 2 / (2.0 * ramp))
+    elif profile == "minimum_jerk":
+        return tau ** 3 * (10.0 - 15.0 * tau + 6.0 * tau * tau)
+    return tau